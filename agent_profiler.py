@@ -0,0 +1,194 @@
+"""
+Agent 性能剖析
+定位一次会话的时间花在哪：模型调用（含 messages 的 JSON 序列化）、read_swagger 的解析、
+run_pytest 的子进程启动……默认关闭，关闭时主循环和工具调用只多一次 None 判断。
+
+开启方式：run_agent(..., profile=目录) 或环境变量 AGENT_PROFILE=1 / 目录
+输出（默认 .agent_cache/profiles/<时间>/）：
+- turn-03-model.pstats、turn-03-tool-02-read_swagger.pstats：每轮模型调用和每次工具调用的 cProfile 数据，
+  可用 python -m pstats 或 snakeviz 查看
+- stacks.folded：采样得到的折叠栈（根节点为 "turn N;model" / "turn N;tool 名称"），
+  可直接交给 flamegraph.pl 或 speedscope 生成火焰图
+- summary.txt：每轮耗时拆分、工具耗时汇总、消息历史大小与进程内存峰值、累计耗时最高的函数
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILES_DIR = os.path.join(PROJECT_DIR, ".agent_cache", "profiles")
+
+_THIS_FILE = os.path.abspath(__file__)
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 128
+
+
+def _peak_rss_mb() -> float:
+    """进程内存峰值（MB），不支持的平台返回 0"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class StackSampler:
+    """后台线程定时采样已登记线程的调用栈，按 "标签;栈帧..." 计数"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.labels = {}        # 线程 id -> 根标签
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, label in list(self.labels.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    # 工具线程中剖析器自身及以上的帧（线程启动、注册表调度）不计入
+                    if code.co_filename == _THIS_FILE:
+                        break
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.counts[";".join([label, *reversed(stack)])] += 1
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class AgentProfiler:
+    """一次会话的剖析数据"""
+
+    def __init__(self, output_dir: str = None, interval: float = SAMPLE_INTERVAL):
+        self.output_dir = output_dir or os.path.join(PROFILES_DIR,
+                                                     time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.sampler = StackSampler(interval)
+        self.turn = 0
+        self.phases = []        # (轮次, 阶段, 名称, 耗时秒)
+        self.history = []       # (轮次, 消息数, 序列化字节数, 最大内容块字节数, 进程内存峰值 MB)
+        self.pstats_files = []
+        self._tool_seq = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.sampler.start()
+
+    @contextmanager
+    def _profiled(self, root_label: str, file_stem: str, phase: str, name: str):
+        thread_id = threading.get_ident()
+        self.sampler.labels[thread_id] = root_label
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 同一时刻只能有一个 cProfile 生效（被放弃的超时工具可能还在跑），只保留采样数据
+            profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.sampler.labels.pop(thread_id, None)
+            if profile is not None:
+                profile.disable()
+                path = os.path.join(self.output_dir, f"{file_stem}.pstats")
+                profile.dump_stats(path)
+            with self._lock:
+                self.phases.append((self.turn, phase, name, elapsed))
+                if profile is not None:
+                    self.pstats_files.append(path)
+
+    def model_call(self, turn: int):
+        """包住一轮的模型调用"""
+        self.turn = turn
+        return self._profiled(f"turn {turn};model", f"turn-{turn:02d}-model", "model", "model")
+
+    def run_tool(self, name: str, func, input_data: dict):
+        """在工具线程内执行并剖析一次工具调用"""
+        with self._lock:
+            self._tool_seq += 1
+            seq = self._tool_seq
+        stem = f"turn-{self.turn:02d}-tool-{seq:02d}-{name}"
+        with self._profiled(f"turn {self.turn};tool {name}", stem, "tool", name):
+            return func(**input_data)
+
+    def record_messages(self, turn: int, messages: list):
+        """记录本轮调用模型前消息历史的大小（即本轮发送的内容），找出撑大上下文的内容块"""
+        largest = 0
+        for message in messages:
+            content = message["content"]
+            blocks = content if isinstance(content, list) else [content]
+            for block in blocks:
+                largest = max(largest, len(json.dumps(block, ensure_ascii=False, default=str)))
+        size = len(json.dumps(messages, ensure_ascii=False, default=str).encode("utf-8"))
+        self.history.append((turn, len(messages), size, largest, _peak_rss_mb()))
+
+    def stop(self) -> str:
+        """停止采样，写出折叠栈和汇总，返回汇总文本"""
+        self.sampler.stop()
+        self.sampler.write(os.path.join(self.output_dir, "stacks.folded"))
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, "summary.txt"), 'w', encoding='utf-8') as f:
+            f.write(summary)
+        return summary
+
+    def summary(self, top: int = 15) -> str:
+        lines = [f"剖析结果：{self.output_dir}", "", "每轮耗时（秒）：模型 / 工具"]
+        turns = sorted({phase[0] for phase in self.phases})
+        for turn in turns:
+            model = sum(p[3] for p in self.phases if p[0] == turn and p[1] == "model")
+            tools = sum(p[3] for p in self.phases if p[0] == turn and p[1] == "tool")
+            lines.append(f"  第 {turn} 轮：{model:.2f} / {tools:.2f}")
+
+        tool_stats = {}
+        for _, phase, name, elapsed in self.phases:
+            if phase == "tool":
+                count, total, peak = tool_stats.get(name, (0, 0.0, 0.0))
+                tool_stats[name] = (count + 1, total + elapsed, max(peak, elapsed))
+        if tool_stats:
+            lines += ["", "工具耗时：次数 / 合计 / 最长（秒）"]
+            for name, (count, total, peak) in sorted(tool_stats.items(),
+                                                     key=lambda kv: -kv[1][1]):
+                lines.append(f"  {name}：{count} / {total:.2f} / {peak:.2f}")
+
+        if self.history:
+            lines += ["", "消息历史：消息数 / 序列化大小 / 最大内容块 / 进程内存峰值"]
+            for turn, count, size, largest, rss in self.history:
+                lines.append(f"  第 {turn} 轮：{count} / {size / 1024:.1f} KB / "
+                             f"{largest / 1024:.1f} KB / {rss:.0f} MB")
+
+        if self.pstats_files:
+            buffer = io.StringIO()
+            stats = pstats.Stats(*self.pstats_files, stream=buffer)
+            stats.files = []  # 不逐个列出合并的文件名
+            stats.sort_stats("cumulative").print_stats(top)
+            lines += ["", f"累计耗时最高的 {top} 个函数（所有阶段合并）：", buffer.getvalue().strip()]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,414 @@
+"""
+Agent 服务模式
+把 run_agent 放到 HTTP 接口后面，其他团队可以提交 Swagger 文档和指令，异步获取结果：
+
+- POST /jobs                   提交任务，请求体 {"instruction", "spec": {"name", "content"}, "max_turns"}
+                               返回 202；队列已满时返回 429 + Retry-After
+- GET  /jobs                   任务列表
+- GET  /jobs/<id>              任务状态和结果
+- GET  /jobs/<id>/events       Server-Sent Events 推送轮次和工具调用进度，支持 Last-Event-ID 续传
+- GET  /jobs/<id>/files/<路径>  下载任务工作目录中的文件，如 tests/test_petstore.py
+- GET  /health                 队列长度和工作线程状态
+
+每个任务在 JOBS_DIR/<id>/workspace 下有独立的工作目录（swagger/、tests/），任务状态
+（job.json）和事件日志（events.jsonl）保存在 JOBS_DIR/<id>/ 下。服务重启后历史任务仍可查询，
+排队中的任务重新入队，执行中被打断的任务标记为 interrupted。
+所有任务在同一进程内执行，共用 model_client 的限流客户端，只依赖标准库。
+
+启动：python agent_server.py --port 8700 --workers 2 --queue-size 16
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+JOBS_DIR = os.path.join(PROJECT_DIR, ".agent_cache", "jobs")
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_MAX_TURNS = 15
+MAX_TURNS_LIMIT = 50
+MAX_BODY_BYTES = 10 * 1024 * 1024
+RETRY_AFTER_SECONDS = 30
+HEARTBEAT_SECONDS = 15
+
+FINISHED = ("succeeded", "failed", "interrupted")
+SPEC_SUFFIXES = ('.json', '.yaml', '.yml')
+
+
+def _write_json(path: str, data):
+    """先写临时文件再替换，进程中途退出也不会留下半个 job.json"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+class JobStore:
+    """任务状态和事件日志，持久化到 JOBS_DIR；事件追加时唤醒等待中的 SSE 连接"""
+
+    def __init__(self, root: str = JOBS_DIR):
+        self.root = root
+        self.jobs = {}    # id -> 任务记录
+        self.events = {}  # id -> 事件列表，首次读取时从 events.jsonl 加载
+        self.cond = threading.Condition()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        for job_id in os.listdir(self.root):
+            path = os.path.join(self.root, job_id, "job.json")
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.jobs[job_id] = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if self.jobs[job_id]["status"] == "running":
+                self.update(job_id, status="interrupted", finished_at=time.time(),
+                            error="服务重启，任务执行被中断")
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def workspace(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id, "workspace")
+
+    def create(self, instruction: str, max_turns: int, spec: dict = None) -> dict:
+        """创建任务和它的工作目录：复制 tests/conftest.py，写入提交的文档"""
+        job_id = uuid.uuid4().hex[:12]
+        workspace = self.workspace(job_id)
+        os.makedirs(os.path.join(workspace, "tests"))
+        os.makedirs(os.path.join(workspace, "swagger"))
+        for name in ("__init__.py", "conftest.py"):
+            source = os.path.join(PROJECT_DIR, "tests", name)
+            if os.path.exists(source):
+                shutil.copy(source, os.path.join(workspace, "tests", name))
+        if spec:
+            with open(os.path.join(workspace, "swagger", spec["name"]), 'w',
+                      encoding='utf-8') as f:
+                f.write(spec["content"])
+
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "instruction": instruction,
+            "spec": f"swagger/{spec['name']}" if spec else None,
+            "max_turns": max_turns,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "files": [],
+        }
+        with self.cond:
+            self.jobs[job_id] = job
+            self.events[job_id] = []
+            _write_json(os.path.join(self.job_dir(job_id), "job.json"), job)
+        return dict(job)
+
+    def get(self, job_id: str) -> dict:
+        with self.cond:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self) -> list:
+        with self.cond:
+            return sorted((dict(job) for job in self.jobs.values()),
+                          key=lambda job: job["created_at"], reverse=True)
+
+    def update(self, job_id: str, **fields):
+        with self.cond:
+            job = self.jobs[job_id]
+            job.update(fields)
+            _write_json(os.path.join(self.job_dir(job_id), "job.json"), job)
+            self.cond.notify_all()
+
+    def _events(self, job_id: str) -> list:
+        if job_id not in self.events:
+            events = []
+            try:
+                with open(os.path.join(self.job_dir(job_id), "events.jsonl"), 'r',
+                          encoding='utf-8') as f:
+                    events = [json.loads(line) for line in f if line.strip()]
+            except (OSError, json.JSONDecodeError):
+                pass
+            self.events[job_id] = events
+        return self.events[job_id]
+
+    def append_event(self, job_id: str, event: dict):
+        with self.cond:
+            events = self._events(job_id)
+            event = {"id": len(events) + 1, "time": time.time(), **event}
+            events.append(event)
+            with open(os.path.join(self.job_dir(job_id), "events.jsonl"), 'a',
+                      encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+            self.cond.notify_all()
+
+    def wait_events(self, job_id: str, after: int, timeout: float) -> tuple:
+        """返回 (id 大于 after 的事件, 任务是否已结束)；没有新事件时最多等待 timeout 秒"""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: len(self._events(job_id)) > after
+                or self.jobs[job_id]["status"] in FINISHED,
+                timeout
+            )
+            return self._events(job_id)[after:], self.jobs[job_id]["status"] in FINISHED
+
+
+class JobRunner:
+    """固定数量的工作线程从有界队列取任务执行；队列满时拒绝新任务"""
+
+    def __init__(self, store: JobStore, workers: int = DEFAULT_WORKERS,
+                 queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.store = store
+        self.workers = workers
+        self.queue_size = queue_size
+        # 队列本身不设上限：重启后恢复的任务必须全部入队，背压只作用于新提交
+        self.queue = queue.Queue()
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        for job in sorted(self.store.list(), key=lambda job: job["created_at"]):
+            if job["status"] == "queued":
+                self.queue.put(job["id"])
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i + 1}", daemon=True).start()
+
+    def submit(self, job_id: str) -> bool:
+        """入队成功返回 True；队列已满返回 False，由调用方告知客户端稍后重试"""
+        with self.lock:
+            if self.queue.qsize() >= self.queue_size:
+                return False
+            self.queue.put(job_id)
+            return True
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "queue_size": self.queue_size,
+                "running": self.running, "workers": self.workers}
+
+    def _work(self):
+        while True:
+            job_id = self.queue.get()
+            with self.lock:
+                self.running += 1
+            try:
+                self._run(job_id)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+    def _run(self, job_id: str):
+        import api_test_agent
+
+        job = self.store.get(job_id)
+        self.store.update(job_id, status="running", started_at=time.time())
+        reply = {}
+
+        def on_event(event: dict):
+            if event["type"] == "reply":
+                reply["text"] = event["text"]
+            self.store.append_event(job_id, event)
+
+        instruction = job["instruction"]
+        if job["spec"] and job["spec"] not in instruction:
+            instruction += f"\n（Swagger 文档路径：{job['spec']}）"
+        workspace = self.store.workspace(job_id)
+        try:
+            api_test_agent.run_agent(instruction, job["max_turns"], workspace=workspace,
+                                     on_event=on_event)
+            fields = {"status": "succeeded", "result": reply.get("text")}
+        except Exception as e:
+            fields = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        tests_dir = os.path.join(workspace, "tests")
+        files = sorted(f"tests/{name}" for name in os.listdir(tests_dir)
+                       if name.startswith("test_") and name.endswith(".py"))
+        self.store.update(job_id, finished_at=time.time(), files=files, **fields)
+
+
+def parse_submission(body: bytes) -> tuple:
+    """校验提交的任务，返回 (instruction, max_turns, spec)；不合法时抛 ValueError"""
+    try:
+        data = json.loads(body or b"{}")
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"请求体不是合法的 JSON - {e}")
+    if not isinstance(data, dict):
+        raise ValueError("请求体必须是 JSON 对象")
+
+    instruction = data.get("instruction")
+    if not isinstance(instruction, str) or not instruction.strip():
+        raise ValueError("instruction 不能为空")
+    max_turns = data.get("max_turns", DEFAULT_MAX_TURNS)
+    if not isinstance(max_turns, int) or not 1 <= max_turns <= MAX_TURNS_LIMIT:
+        raise ValueError(f"max_turns 必须是 1~{MAX_TURNS_LIMIT} 的整数")
+
+    spec = data.get("spec")
+    if spec is not None:
+        if not isinstance(spec, dict) or not isinstance(spec.get("content"), str):
+            raise ValueError("spec 必须是 {\"name\", \"content\"} 对象")
+        name = spec.get("name") or "spec.json"
+        if os.path.basename(name) != name or not name.endswith(SPEC_SUFFIXES):
+            raise ValueError("spec.name 必须是 .json / .yaml / .yml 文件名")
+        spec = {"name": name, "content": spec["content"]}
+    return instruction.strip(), max_turns, spec
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    store: JobStore = None
+    runner: JobRunner = None
+
+    def _send_json(self, status: int, data, headers: dict = None):
+        body = json.dumps(data, ensure_ascii=False, indent=1).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str, headers: dict = None):
+        self._send_json(status, {"error": message}, headers)
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip("/") != "/jobs":
+            return self._error(404, "未知接口")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            return self._error(413, f"请求体超过 {MAX_BODY_BYTES} 字节")
+        try:
+            instruction, max_turns, spec = parse_submission(self.rfile.read(length))
+        except ValueError as e:
+            return self._error(400, str(e))
+
+        # 先检查容量再建工作目录，被拒绝的提交不留下任何文件
+        if self.runner.queue.qsize() >= self.runner.queue_size:
+            return self._queue_full()
+        job = self.store.create(instruction, max_turns, spec)
+        if not self.runner.submit(job["id"]):
+            self.store.update(job["id"], status="failed", finished_at=time.time(),
+                              error="队列已满，任务未执行")
+            return self._queue_full()
+        self._send_json(202, {**job, "links": self._links(job["id"])},
+                        {"Location": f"/jobs/{job['id']}"})
+
+    def _queue_full(self):
+        self._error(429, f"任务队列已满（{self.runner.queue_size}），请稍后重试",
+                    {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    @staticmethod
+    def _links(job_id: str) -> dict:
+        return {"self": f"/jobs/{job_id}", "events": f"/jobs/{job_id}/events"}
+
+    def do_GET(self):
+        parts = [unquote(p) for p in urlsplit(self.path).path.strip("/").split("/") if p]
+        if parts == ["health"]:
+            return self._send_json(200, {"status": "ok", **self.runner.stats()})
+        if parts == ["jobs"]:
+            return self._send_json(200, self.store.list())
+        if len(parts) < 2 or parts[0] != "jobs" or self.store.get(parts[1]) is None:
+            return self._error(404, "任务不存在")
+
+        job_id = parts[1]
+        if len(parts) == 2:
+            return self._send_json(200, {**self.store.get(job_id), "links": self._links(job_id)})
+        if parts[2:] == ["events"]:
+            return self._stream_events(job_id)
+        if parts[2] == "files" and len(parts) > 3:
+            return self._send_file(job_id, parts[3:])
+        self._error(404, "未知接口")
+
+    def _send_file(self, job_id: str, parts: list):
+        workspace = os.path.realpath(self.store.workspace(job_id))
+        path = os.path.realpath(os.path.join(workspace, *parts))
+        if not path.startswith(workspace + os.sep) or not os.path.isfile(path):
+            return self._error(404, "文件不存在")
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, job_id: str):
+        """SSE：先补发 Last-Event-ID 之后的事件，再推送新事件，任务结束后发送 end 并关闭"""
+        try:
+            cursor = int(self.headers.get("Last-Event-ID") or 0)
+        except ValueError:
+            cursor = 0
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            while True:
+                events, finished = self.store.wait_events(job_id, cursor, HEARTBEAT_SECONDS)
+                for event in events:
+                    data = json.dumps(event, ensure_ascii=False, default=str)
+                    self.wfile.write(f"id: {event['id']}\nevent: {event['type']}\n"
+                                     f"data: {data}\n\n".encode("utf-8"))
+                    cursor = event["id"]
+                if finished:
+                    job = self.store.get(job_id)
+                    data = json.dumps({"status": job["status"], "result": job["result"],
+                                       "error": job["error"], "files": job["files"]},
+                                      ensure_ascii=False)
+                    self.wfile.write(f"event: end\ndata: {data}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    return
+                if not events:
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8700, workers: int = DEFAULT_WORKERS,
+                  queue_size: int = DEFAULT_QUEUE_SIZE, jobs_dir: str = JOBS_DIR):
+    """创建服务并启动工作线程，返回 ThreadingHTTPServer，调用方负责 serve_forever"""
+    store = JobStore(jobs_dir)
+    runner = JobRunner(store, workers, queue_size)
+    runner.start()
+    handler = type("Handler", (AgentRequestHandler,), {"store": store, "runner": runner})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接口自动化测试 Agent 服务模式")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="同时执行的任务数")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="排队任务数上限，超过后新提交返回 429")
+    parser.add_argument("--jobs-dir", default=JOBS_DIR, help="任务状态和工作目录的存放位置")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.workers, args.queue_size, args.jobs_dir)
+    host, port = server.server_address[:2]
+    print(f"🤖 Agent 服务已启动：http://{host}:{port}（{args.workers} 个工作线程，"
+          f"队列上限 {args.queue_size}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n再见！")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,542 @@
+"""
+基于文档的接口模糊测试
+按接口的参数和请求体 schema 批量生成边界值和非法输入，并发发送，把结果归并成
+互不重复的失败特征后紧凑地汇报。
+
+生成的用例（每个用例只改动一处，其余参数保持合法，出问题时能直接定位到参数）：
+- 边界值：int32 / int64 上下限、minimum / maximum、minLength / maxLength
+- 非法值：超出范围、类型错误、枚举外取值、超长字符串、特殊字符、null
+- 缺少必填参数 / 请求体字段、请求体类型错误、畸形 JSON
+用例是否非法由 schema_validator 按文档判定，与 assert_matches_schema 的口径一致。
+
+失败特征（同一特征只报告一次，附次数和一个示例）：
+- server_error         返回 5xx
+- schema_violation     响应体不符合文档中该状态码的 schema
+- accepted_invalid     非法输入被 2xx 接受（缺少参数校验）
+- undocumented_status  返回了文档未定义的状态码
+- transport_error      连接失败 / 超时
+
+并发：线程池 + 共享连接池的 requests.Session（长连接复用），对本地服务每分钟可执行数千个用例。
+
+目标地址：必须显式给出，不会回退到文档 servers（示例文档指向公共的 petstore3.swagger.io）。
+默认只允许本机地址（localhost / 127.0.0.0/8 / ::1）；确认有权测试远程服务时传 allow_remote。
+
+命令行：python api_fuzzer.py swagger/petstore.json --base-url http://127.0.0.1:8000 --concurrency 32
+"""
+import argparse
+import copy
+import ipaddress
+import json
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlsplit
+
+from schema_validator import SchemaRegistry
+
+_HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+_INT_LIMITS = (
+    ("int32", -2**31, 2**31 - 1),
+    ("int64", -2**63, 2**63 - 1),
+)
+PARAM_LONG_STRING = 10_000     # 路径 / 查询 / 请求头参数的超长字符串
+BODY_LONG_STRING = 100_000     # 请求体字段的超长字符串
+MAX_BODY_DEPTH = 3             # 请求体嵌套字段最多变异到第几层
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_MAX_CASES = 200        # 每个接口最多生成的用例数
+DEFAULT_TIMEOUT = 5
+
+SIGNATURE_ORDER = ("server_error", "schema_violation", "accepted_invalid",
+                   "undocumented_status", "transport_error")
+_MISSING = object()
+
+
+class FuzzCase:
+    """一次请求：在合法请求的基础上只改动 target 一处"""
+
+    def __init__(self, op_id: str, method: str, path: str, params: dict, body=_MISSING,
+                 raw_body: str = None, target: str = "", label: str = "合法请求",
+                 invalid: bool = False):
+        self.op_id = op_id
+        self.method = method
+        self.path = path
+        self.params = params      # {"path": {}, "query": {}, "header": {}}
+        self.body = body
+        self.raw_body = raw_body
+        self.target = target      # 如 query.status、body.photoUrls[0]
+        self.label = label
+        self.invalid = invalid
+
+    def describe(self) -> str:
+        return f"{self.target} {self.label}" if self.target else self.label
+
+
+# ---------- 取值 ----------
+
+def _deref(spec: dict, schema: dict, depth: int = 0) -> dict:
+    while isinstance(schema, dict) and "$ref" in schema and depth < 20:
+        node = spec
+        for part in schema["$ref"][2:].split("/"):
+            node = node[part.replace("~1", "/").replace("~0", "~")]
+        schema, depth = node, depth + 1
+    return schema or {}
+
+
+def sample_value(spec: dict, schema: dict, depth: int = 0):
+    """按 schema 构造一个合法值：优先 example / default / enum，其次按类型取值"""
+    schema = _deref(spec, schema)
+    for key in ("example", "default"):
+        if key in schema:
+            return copy.deepcopy(schema[key])
+    if schema.get("enum"):
+        return schema["enum"][0]
+    for key in ("allOf", "oneOf", "anyOf"):
+        if schema.get(key):
+            if key == "allOf":
+                merged = {}
+                for part in schema["allOf"]:
+                    value = sample_value(spec, part, depth + 1)
+                    if isinstance(value, dict):
+                        merged.update(value)
+                return merged
+            return sample_value(spec, schema[key][0], depth + 1)
+
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), None)
+    if schema_type in ("integer", "number"):
+        value = 1 if schema_type == "integer" else 1.5
+        value = max(value, schema.get("minimum", value))
+        value = min(value, schema.get("maximum", value))
+        return int(value) if schema_type == "integer" else float(value)
+    if schema_type == "boolean":
+        return True
+    if schema_type == "array":
+        if depth > MAX_BODY_DEPTH:
+            return []
+        return [sample_value(spec, schema.get("items", {}), depth + 1)
+                for _ in range(max(schema.get("minItems", 1), 1))]
+    if schema_type == "object" or "properties" in schema:
+        if depth > MAX_BODY_DEPTH:
+            return {}
+        return {name: sample_value(spec, prop, depth + 1)
+                for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "string":
+        return _sample_string(schema)
+    return "fuzz"
+
+
+def _sample_string(schema: dict) -> str:
+    formats = {"date-time": "2024-01-01T00:00:00Z", "date": "2024-01-01", "email": "fuzz@example.com",
+               "uuid": "00000000-0000-4000-8000-000000000000", "uri": "https://example.com"}
+    value = formats.get(schema.get("format"), "fuzz")
+    min_length = schema.get("minLength", 0)
+    if len(value) < min_length:
+        value = value.ljust(min_length, "x")
+    if "maxLength" in schema:
+        value = value[:schema["maxLength"]]
+    return value
+
+
+def _schema_type(schema: dict):
+    """schema 的类型；type 为列表时取第一个非 null 的类型"""
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), None)
+    return schema_type
+
+
+def value_mutations(spec: dict, schema: dict, long_string: int) -> list:
+    """针对一个值的变异，返回 [(说明, 值)]，是否非法由调用方按 schema 判定"""
+    schema = _deref(spec, schema)
+    schema_type = _schema_type(schema)
+    mutations = []
+
+    if schema_type in ("integer", "number"):
+        for fmt, low, high in _INT_LIMITS:
+            mutations += [(f"{fmt} 下限", low), (f"{fmt} 上限", high),
+                          (f"{fmt} 下限 - 1", low - 1), (f"{fmt} 上限 + 1", high + 1)]
+        mutations += [("零", 0), ("负数", -1)]
+        for key, delta in (("minimum", -1), ("maximum", 1)):
+            if key in schema:
+                mutations += [(key, schema[key]), (f"{key} 越界", schema[key] + delta)]
+        if schema_type == "integer":
+            mutations.append(("小数", 1.5))
+        else:
+            mutations += [("极大浮点数", 1e308), ("极小浮点数", -1e308)]
+        mutations.append(("类型错误：字符串", "abc"))
+    elif schema_type == "string":
+        mutations += [("空字符串", ""), ("超长字符串", "A" * long_string),
+                      ("特殊字符", "💥\u0000'\"<>%;--"), ("SQL 注入", "' OR '1'='1"),
+                      ("路径穿越", "../../etc/passwd"), ("类型错误：数字", 12345)]
+        if "maxLength" in schema:
+            mutations.append(("maxLength + 1", "a" * (schema["maxLength"] + 1)))
+        if schema.get("minLength"):
+            mutations.append(("minLength - 1", "a" * (schema["minLength"] - 1)))
+        if schema.get("format"):
+            mutations.append((f"{schema['format']} 格式错误", "not-a-valid-value"))
+    elif schema_type == "boolean":
+        mutations += [("类型错误：字符串", "yes"), ("类型错误：数字", 2)]
+    elif schema_type == "array":
+        item = sample_value(spec, schema.get("items", {}))
+        mutations += [("空数组", []), ("类型错误：字符串", "fuzz"),
+                      ("元素类型错误", [{"fuzz": True}] if not isinstance(item, dict) else ["fuzz"]),
+                      ("超多元素", [item] * 1000)]
+    elif schema_type == "object" or "properties" in schema:
+        mutations += [("空对象", {}), ("类型错误：数组", []), ("类型错误：字符串", "fuzz")]
+
+    enum = schema.get("enum")
+    if enum:
+        mutations.append(("枚举外取值", "__not_in_enum__"))
+        upper = [v.upper() for v in enum if isinstance(v, str) and v.upper() != v]
+        if upper:
+            mutations.append(("枚举值大小写错误", upper[0]))
+    return mutations
+
+
+# ---------- 生成用例 ----------
+
+def _operations(spec: dict):
+    for path, item in spec.get("paths", {}).items():
+        shared = item.get("parameters", [])
+        for method in _HTTP_METHODS:
+            op = item.get(method)
+            if op is not None:
+                yield path, method.upper(), op, shared + op.get("parameters", [])
+
+
+def _body_schema(spec: dict, op: dict, params: list):
+    """OpenAPI 3 取 requestBody 的 JSON schema，Swagger 2 取 in: body 参数；没有请求体返回 None"""
+    for param in params:
+        if param.get("in") == "body":
+            return param.get("schema", {}), bool(param.get("required"))
+    body = _deref(spec, op.get("requestBody")) if "requestBody" in op else None
+    if not body:
+        return None, False
+    content = body.get("content", {})
+    media = content.get("application/json") or next(iter(content.values()), {})
+    return media.get("schema", {}), bool(body.get("required"))
+
+
+def _set_in(value, path: list, new):
+    """返回把 path 处替换为 new 后的副本；new 为 _MISSING 时删除该字段"""
+    value = copy.deepcopy(value)
+    node = value
+    for key in path[:-1]:
+        node = node[key]
+    if new is _MISSING:
+        del node[path[-1]]
+    else:
+        node[path[-1]] = new
+    return value
+
+
+def _body_targets(spec: dict, schema: dict, value, path: list, depth: int = 0):
+    """遍历请求体中可变异的位置，产出 (路径, schema, 是否必填)"""
+    schema = _deref(spec, schema)
+    if depth >= MAX_BODY_DEPTH:
+        return
+    if isinstance(value, dict):
+        required = set(schema.get("required", []))
+        for name, prop in schema.get("properties", {}).items():
+            if name in value:
+                yield path + [name], prop, name in required
+                yield from _body_targets(spec, prop, value[name], path + [name], depth + 1)
+    elif isinstance(value, list) and value:
+        items = schema.get("items", {})
+        yield path + [0], items, False
+        yield from _body_targets(spec, items, value[0], path + [0], depth + 1)
+
+
+def _format_path(path: list) -> str:
+    text = "body"
+    for key in path:
+        text += f"[{key}]" if isinstance(key, int) else f".{key}"
+    return text
+
+
+def generate_cases(spec: dict, operations: list = None,
+                   max_cases: int = DEFAULT_MAX_CASES) -> list:
+    """为文档中的接口生成用例；operations 可以限定 operationId 或 "GET /path" """
+    registry = SchemaRegistry(spec)
+    cases = []
+    for path, method, op, params in _operations(spec):
+        op_id = op.get("operationId") or f"{method} {path}"
+        if operations and op_id not in operations and f"{method} {path}" not in operations:
+            continue
+
+        base = {"path": {}, "query": {}, "header": {}}
+        declared = []
+        for param in params:
+            param = _deref(spec, param)
+            location = param.get("in")
+            if location not in base:
+                continue
+            # Swagger 2 的参数把类型直接写在参数上
+            schema = param.get("schema") or {k: v for k, v in param.items()
+                                              if k in ("type", "format", "enum", "items",
+                                                       "minimum", "maximum", "minLength",
+                                                       "maxLength")}
+            declared.append((location, param["name"], schema, bool(param.get("required"))))
+            if param.get("required") or location == "path":
+                base[location][param["name"]] = sample_value(spec, schema)
+        body_schema, body_required = _body_schema(spec, op, params)
+        body = sample_value(spec, body_schema) if body_schema is not None else _MISSING
+
+        def case(target="", label="合法请求", invalid=False, params_=None, body_=body,
+                 raw_body=None):
+            return FuzzCase(op_id, method, path, params_ or base, body_, raw_body, target,
+                            label, invalid)
+
+        groups = [[case()]]
+        for location, name, schema, required in declared:
+            check = registry.compile(schema)
+            # 路径、查询和请求头参数以文本发送：数字 12345 到服务端就是合法的字符串 "12345"
+            as_text = _schema_type(_deref(spec, schema)) == "string"
+            group = []
+            for label, value in value_mutations(spec, schema, PARAM_LONG_STRING):
+                if location == "path" and value in ("", [], {}):
+                    continue  # 空的路径参数请求的是另一个 URL
+                errors = []
+                check(str(_query_value(value)) if as_text else value, "$", errors)
+                mutated = {k: dict(v) for k, v in base.items()}
+                mutated[location][name] = value
+                group.append(case(f"{location}.{name}", label, bool(errors), mutated))
+            if required and location != "path":
+                mutated = {k: dict(v) for k, v in base.items()}
+                mutated[location].pop(name, None)
+                group.append(case(f"{location}.{name}", "缺少必填参数", True, mutated))
+            groups.append(group)
+
+        if body is not _MISSING:
+            body_check = registry.compile(body_schema)
+            group = [case("body", "请求体为空", body_required, body_=_MISSING),
+                     case("body", "畸形 JSON", True, body_=_MISSING, raw_body='{"fuzz": '),
+                     case("body", "类型错误：数组", isinstance(body, dict), body_=[body])]
+            for target_path, schema, required in _body_targets(spec, body_schema, body, []):
+                target = _format_path(target_path)
+                if required:
+                    group.append(case(target, "缺少必填字段", True,
+                                      body_=_set_in(body, target_path, _MISSING)))
+                mutations = value_mutations(spec, schema, BODY_LONG_STRING) + [("null", None)]
+                for label, value in mutations:
+                    mutated = _set_in(body, target_path, value)
+                    errors = []
+                    body_check(mutated, "$", errors)
+                    group.append(case(target, label, bool(errors), body_=mutated))
+            groups.append(group)
+
+        cases.extend(_interleave(groups, max_cases))
+    return cases
+
+
+def _interleave(groups: list, limit: int) -> list:
+    """轮流从每个参数的用例中取，用例数受限时各个参数都能覆盖到"""
+    result, index = [], 0
+    while len(result) < limit and any(index < len(group) for group in groups):
+        for group in groups:
+            if index < len(group) and len(result) < limit:
+                result.append(group[index])
+        index += 1
+    return result
+
+
+# ---------- 执行 ----------
+
+def _query_value(value):
+    """查询参数取值：布尔值写成 true / false，对象和嵌套数组按 JSON 发送"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, dict) or (isinstance(value, list)
+                                   and any(isinstance(v, (dict, list)) for v in value)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _send(session, base_url: str, case: FuzzCase, timeout: float) -> tuple:
+    """发送一个用例，返回 (状态码, Content-Type, 响应体, 异常)"""
+    path = case.path
+    for name, value in case.params["path"].items():
+        path = path.replace("{" + name + "}", quote(str(value), safe=""))
+    kwargs = {
+        "params": {k: _query_value(v) for k, v in case.params["query"].items() if v is not None},
+        "headers": {k: str(v) for k, v in case.params["header"].items() if v is not None},
+        "timeout": timeout,
+    }
+    if case.raw_body is not None:
+        kwargs["data"] = case.raw_body.encode("utf-8")
+        kwargs["headers"]["Content-Type"] = "application/json"
+    elif case.body is not _MISSING:
+        kwargs["json"] = case.body
+    try:
+        response = session.request(case.method, base_url + path, **kwargs)
+        return response.status_code, response.headers.get("Content-Type", ""), response.content, None
+    except Exception as e:
+        return None, "", b"", e
+
+
+class FuzzReport:
+    """按失败特征归并结果"""
+
+    def __init__(self, spec: dict):
+        self.registry = SchemaRegistry(spec)
+        self.total = 0
+        self.statuses = Counter()
+        self.signatures = {}  # (类型, 接口, 细节) -> {"count", "example", "labels"}
+        self.operations = set()
+        self.elapsed = 0.0
+
+    def _hit(self, kind: str, case: FuzzCase, detail: str, example: str):
+        key = (kind, case.op_id, detail)
+        entry = self.signatures.setdefault(key, {"count": 0, "example": example, "labels": []})
+        entry["count"] += 1
+        if case.label not in entry["labels"]:
+            entry["labels"].append(case.label)
+
+    def add(self, case: FuzzCase, status, content_type: str, content: bytes, error):
+        self.total += 1
+        self.operations.add(case.op_id)
+        if error is not None:
+            self.statuses["error"] += 1
+            self._hit("transport_error", case, type(error).__name__,
+                      f"{case.describe()} → {type(error).__name__}: {str(error)[:120]}")
+            return
+
+        self.statuses[status] += 1
+        snippet = content[:160].decode("utf-8", errors="replace").replace("\n", " ")
+        example = f"{case.describe()} → {status} {snippet}".rstrip()
+        if status >= 500:
+            self._hit("server_error", case, f"{status} {_normalize(snippet[:80])}", example)
+        elif case.invalid and 200 <= status < 300:
+            self._hit("accepted_invalid", case, case.target, example)
+
+        try:
+            validator = self.registry.response_validator(case.op_id, status)
+        except KeyError:
+            if status < 500:
+                self._hit("undocumented_status", case, str(status), example)
+            return
+        if "json" not in content_type or not content:
+            return
+        try:
+            body = json.loads(content)
+        except ValueError:
+            self._hit("schema_violation", case, f"{status} 响应不是合法 JSON", example)
+            return
+        errors = []
+        validator(body, "$", errors)
+        if errors:
+            self._hit("schema_violation", case, f"{status} {_normalize(errors[0])}",
+                      f"{example}\n    {errors[0]}")
+
+    def format(self, concurrency: int, max_signatures: int = 30) -> str:
+        rate = self.total / self.elapsed if self.elapsed else 0
+        lines = [
+            f"模糊测试：{len(self.operations)} 个接口，{self.total} 个用例，"
+            f"耗时 {self.elapsed:.1f} 秒（{rate:.0f} 个/秒），并发 {concurrency}",
+            "状态码分布：" + " ".join(f"{status}×{count}" for status, count
+                                  in sorted(self.statuses.items(), key=lambda kv: str(kv[0]))),
+        ]
+        if not self.signatures:
+            lines.append("未发现失败特征")
+            return "\n".join(lines)
+
+        ordered = sorted(self.signatures.items(),
+                         key=lambda kv: (SIGNATURE_ORDER.index(kv[0][0]), -kv[1]["count"]))
+        lines.append(f"发现 {len(ordered)} 个失败特征：")
+        for (kind, op_id, detail), entry in ordered[:max_signatures]:
+            labels = "、".join(entry["labels"][:5]) + ("等" if len(entry["labels"]) > 5 else "")
+            lines.append(f"[{kind}] {op_id} {detail} ×{entry['count']}（{labels}）")
+            lines.append(f"  示例：{entry['example']}")
+        if len(ordered) > max_signatures:
+            lines.append(f"……另有 {len(ordered) - max_signatures} 个特征未展开")
+        return "\n".join(lines)
+
+
+def _normalize(text: str) -> str:
+    """去掉数组下标、校验错误中的具体取值和数字，同一类问题归并为一个特征"""
+    text = re.sub(r"\[\d+\]", "[]", text)
+    # "$.status: 'x' 不在枚举 [...] 中" → "$.status: 不在枚举 [...] 中"
+    text = re.sub(r": .*? (不在枚举|小于下限|超过上限|不匹配)", r": \1", text)
+    return re.sub(r"\d+", "N", text)
+
+
+def run_fuzz(spec: dict, base_url: str, cases: list, concurrency: int = DEFAULT_CONCURRENCY,
+             timeout: float = DEFAULT_TIMEOUT, cancel=None) -> FuzzReport:
+    """并发执行用例，返回 FuzzReport；cancel（threading.Event）置位后不再发送剩余用例"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    report = FuzzReport(spec)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept": "application/json"})
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(_send, session, base_url.rstrip("/"), case, timeout): case
+                   for case in cases}
+        for future in as_completed(futures):
+            if cancel is not None and cancel.is_set():
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+            report.add(futures[future], *future.result())
+    report.elapsed = time.monotonic() - start
+    session.close()
+    return report
+
+
+def is_local_url(base_url: str) -> bool:
+    """地址是否指向本机"""
+    host = (urlsplit(base_url).hostname or "").lower()
+    if host == "localhost" or host.endswith(".localhost"):
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def fuzz(spec: dict, base_url: str, operations: list = None, max_cases: int = DEFAULT_MAX_CASES,
+         concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+         allow_remote: bool = False, cancel=None) -> str:
+    """生成用例、执行并返回报告文本；非本机地址需要 allow_remote=True，否则抛 ValueError"""
+    if not base_url:
+        raise ValueError("未指定被测服务地址 base_url")
+    if not allow_remote and not is_local_url(base_url):
+        raise ValueError(f"{base_url} 不是本机地址。模糊测试会发送大量畸形请求，确认有权测试该服务后"
+                         f"再显式允许远程地址（命令行 --allow-remote，Agent 设置 FUZZ_ALLOW_REMOTE=1）")
+    cases = generate_cases(spec, operations, max_cases)
+    if not cases:
+        return "没有匹配的接口"
+    return run_fuzz(spec, base_url, cases, concurrency, timeout, cancel).format(concurrency)
+
+
+def main():
+    from spec_loader import load_spec
+
+    parser = argparse.ArgumentParser(description="基于文档的接口模糊测试")
+    parser.add_argument("spec", help="Swagger 文档路径")
+    parser.add_argument("--base-url", required=True, help="被测服务地址，如 http://127.0.0.1:8000")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="允许测试非本机地址（确认有权测试该服务时使用）")
+    parser.add_argument("--operation", action="append", help="只测试指定接口，可重复")
+    parser.add_argument("--max-cases", type=int, default=DEFAULT_MAX_CASES, help="每个接口的用例数上限")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    try:
+        print(fuzz(spec, args.base_url, args.operation, args.max_cases, args.concurrency,
+                   args.timeout, args.allow_remote))
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
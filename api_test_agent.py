@@ -3,185 +3,458 @@
 功能：读取 Swagger 文档 → 生成 pytest 测试用例 → 执行测试 → 自动修复错误
 """
 
-import anthropic
+import contextvars
+import hashlib
 import json
 import subprocess
 import os
-import requests
-from dotenv import load_dotenv
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import nullcontext
 
-load_dotenv()
-client = anthropic.Anthropic()
+from coverage_matrix import HTTP_LOG_FILE, build_matrix, format_gaps
+from flaky_tracker import FLAKY_FILE, FlakyTracker, triage_failures
+from model_client import get_shared_client
+from spec_loader import default_spec_path, load_spec
+from spec_render import estimate_tokens, render_compact, render_within_budget
+from tool_registry import ToolRegistry, ToolResultCache, cancel_event, time_left
+
+# anthropic / requests 导入较慢，且创建客户端需要 API Key，
+# 因此延迟到第一次调用模型或发请求时再导入，只用工具函数时不受影响
+_client = None
+_env_loaded = False
+
+
+def load_env():
+    """加载 .env（只加载一次，不覆盖已有的环境变量）。
+    限流参数（ANTHROPIC_RPM 等）和 AGENT_PROFILE 在创建客户端之前就会被读取，需要先加载"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def get_client():
+    """获取 Anthropic 客户端，首次调用时创建"""
+    global _client
+    if _client is None:
+        import anthropic
+        load_env()
+        # 重试由 model_client 统一处理（限流退避 + 自适应并发），关闭 SDK 自带的重试
+        _client = anthropic.Anthropic(max_retries=0)
+    return _client
+
+
+def __getattr__(name):
+    # 兼容 from api_test_agent import client 的旧写法
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # 项目根目录
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# 当前会话的工作目录：命令行模式下是项目根目录；服务模式（agent_server.py）下每个任务
+# 有独立的目录，工具读写的 tests/、swagger/ 和运行时记录都相对它
+_workspace = contextvars.ContextVar("workspace", default=PROJECT_DIR)
+
+
+def workspace_dir() -> str:
+    return _workspace.get()
+
+
+def _workspace_path(*parts: str) -> str:
+    """把工具参数中的路径解析到当前工作目录内；.. 或绝对路径跳出工作目录时抛 ValueError，
+    服务模式下任务之间、任务与项目根目录之间因此互不可见"""
+    root = os.path.realpath(workspace_dir())
+    path = os.path.realpath(os.path.join(root, *parts))
+    if path != root and not path.startswith(root + os.sep):
+        raise ValueError(f"路径超出工作目录 - {os.path.join(*parts)}")
+    return path
+
+
+# 每个工作目录最近读取的文档，run_pytest 把它作为 API_SPEC 传给测试，
+# 让 base_url、assert_matches_schema 等 fixtures 对应正在处理的文档
+_specs_in_use = {}
+
+
+def _use_spec(path: str, **_):
+    """工具的 on_call 回调：记录本工作目录当前使用的文档。
+    由注册表在每次成功调用后执行，结果命中缓存、工具函数没有运行时也会记录"""
+    if path.endswith(('.json', '.yaml', '.yml')):
+        _specs_in_use[os.path.realpath(workspace_dir())] = _workspace_path(path)
+
+
+def _spec_in_use() -> str:
+    """当前工作目录下测试使用的文档（绝对路径）：本会话最近读取的文档 > 环境变量 API_SPEC >
+    swagger/ 下唯一的文档 > swagger/petstore.json"""
+    root = os.path.realpath(workspace_dir())
+    if root in _specs_in_use:
+        return _specs_in_use[root]
+    if os.environ.get("API_SPEC"):
+        return os.path.join(root, os.environ["API_SPEC"])
+    return default_spec_path(root)
+
+
+def _in_workspace(path: str) -> str:
+    """把项目根目录下的运行时文件（覆盖记录、不稳定用例统计）映射到当前工作目录"""
+    return os.path.join(workspace_dir(), os.path.relpath(path, PROJECT_DIR))
+
+# read_swagger 紧凑格式默认的 token 预算
+DEFAULT_SPEC_TOKENS = 20000
+
+# run_pytest 失败用例默认重跑次数
+DEFAULT_RERUNS = 2
+
+# send_http_request 响应体：最多读取的字节数、读取总时长、返回给模型的预览字符数
+HTTP_BODY_MAX_BYTES = 256 * 1024
+HTTP_READ_SECONDS = 15
+HTTP_BODY_PREVIEW = 2000
+
+# 写入测试文件后收集用例的超时秒数和返回的错误输出长度
+COLLECT_TIMEOUT = 20
+COLLECT_OUTPUT_LIMIT = 2000
+
 # ============================================================
-# 1. 定义工具
+# 1. 工具注册表
 # ============================================================
-tools = [
-    {
-        "name": "read_swagger",
-        "description": "读取 Swagger/OpenAPI 文档，获取接口定义。支持 JSON 和 YAML 格式",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "file_path": {
-                    "type": "string",
-                    "description": "Swagger 文件路径，如 swagger/api.json"
-                }
-            },
-            "required": ["file_path"]
-        }
-    },
-    {
-        "name": "write_test_file",
-        "description": "将生成的 pytest 测试代码写入文件",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "file_name": {
-                    "type": "string",
-                    "description": "测试文件名，如 test_users.py"
-                },
-                "content": {
-                    "type": "string",
-                    "description": "pytest 测试代码内容"
-                }
-            },
-            "required": ["file_name", "content"]
-        }
-    },
-    {
-        "name": "run_pytest",
-        "description": "运行 pytest 测试，返回测试结果",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "test_file": {
-                    "type": "string",
-                    "description": "要运行的测试文件，如 test_users.py。不填则运行全部测试"
-                }
-            },
-            "required": []
-        }
-    },
-    {
-        "name": "read_file",
-        "description": "读取任意文件内容",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "file_path": {
-                    "type": "string",
-                    "description": "文件路径"
-                }
-            },
-            "required": ["file_path"]
-        }
-    },
-    {
-        "name": "send_http_request",
-        "description": "发送 HTTP 请求测试接口",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "method": {
-                    "type": "string",
-                    "description": "HTTP 方法：GET, POST, PUT, DELETE"
-                },
-                "url": {
-                    "type": "string",
-                    "description": "完整的请求 URL"
-                },
-                "headers": {
-                    "type": "object",
-                    "description": "请求头"
-                },
-                "body": {
-                    "type": "object",
-                    "description": "请求体（JSON）"
-                }
-            },
-            "required": ["method", "url"]
-        }
-    },
-    {
-        "name": "list_files",
-        "description": "列出目录下的文件",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "directory": {
-                    "type": "string",
-                    "description": "目录路径，默认为项目根目录"
-                }
-            },
-            "required": []
-        }
-    }
-]
+# 工具的 input_schema 由函数签名生成，调用时按声明的超时和并发数限制执行
+registry = ToolRegistry()
+
+
+def _files(*paths: str) -> list:
+    """工具依赖的文件（相对当前工作目录），供 watch 判断缓存的结果是否仍然有效"""
+    return [os.path.join(workspace_dir(), path) for path in paths]
 
 # ============================================================
 # 2. 工具实现
 # ============================================================
 
-def read_swagger(file_path: str) -> str:
+@registry.tool(
+    "读取 Swagger/OpenAPI 文档，获取接口定义。支持 JSON 和 YAML 格式。"
+    "默认返回紧凑格式：共享 schema 只列一次，字段后的 * 表示必填，"
+    "参数写作 名称@位置:类型，相同响应的状态码合并为一行",
+    params={
+        "file_path": "Swagger 文件路径，如 swagger/api.json",
+        "output_format": {
+            "enum": ["compact", "json"],
+            "description": "compact（默认）为紧凑格式，json 为完整原文"
+        },
+        "verbosity": {
+            "enum": ["full", "normal", "minimal"],
+            "description": "紧凑格式的详细程度，不填则按 max_tokens 自动选择"
+        },
+        "max_tokens": "紧凑格式的 token 预算，默认 20000"
+    },
+    timeout=30, idempotent=True,
+    watch=lambda file_path, **_: _files(file_path),
+    on_call=lambda file_path, **_: _use_spec(file_path)
+)
+def read_swagger(file_path: str, output_format: str = "compact", verbosity: str = None,
+                 max_tokens: int = DEFAULT_SPEC_TOKENS) -> str:
     """读取 Swagger 文档"""
-    full_path = os.path.join(PROJECT_DIR, file_path)
     try:
+        full_path = _workspace_path(file_path)
+        # JSON / YAML 走解析缓存，重复读取同一文档无需重新解析
+        if file_path.endswith(('.json', '.yaml', '.yml')):
+            data = load_spec(full_path)
+            if output_format == "json":
+                return json.dumps(data, indent=2, ensure_ascii=False)
+            if verbosity:
+                text = render_compact(data, verbosity)
+                tokens = estimate_tokens(text)
+            else:
+                text, verbosity, tokens = render_within_budget(data, max_tokens)
+            return f"[compact verbosity={verbosity} ≈{tokens} tokens]\n{text}"
+
         with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 尝试解析 JSON
-        if file_path.endswith('.json'):
-            data = json.loads(content)
-            return json.dumps(data, indent=2, ensure_ascii=False)
-        
-        # YAML 格式
-        elif file_path.endswith(('.yaml', '.yml')):
-            import yaml
-            data = yaml.safe_load(content)
-            return json.dumps(data, indent=2, ensure_ascii=False)
-        
-        return content
+            return f.read()
     except FileNotFoundError:
-        return f"错误：文件不存在 - {full_path}"
+        return f"错误：文件不存在 - {file_path}"
     except Exception as e:
         return f"错误：读取文件失败 - {str(e)}"
 
+def _collect_errors(file_path: str) -> list:
+    """只收集不执行（--collect-only），返回收集阶段的错误（导入失败、fixture 定义错误等）"""
+    try:
+        code, output = _pytest_main([file_path, "--collect-only", "-q", "--tb=short",
+                                     "-p", "no:cacheprovider"], _pytest_env(),
+                                    timeout=COLLECT_TIMEOUT)
+    except (subprocess.TimeoutExpired, OSError):
+        # 收集本身出问题时不影响写入结果，留给 run_pytest 报告
+        return []
+    if code == 0:
+        return []
+    if code == 5:
+        return ["没有收集到测试用例（测试函数需以 test_ 开头）"]
+    lines = output.splitlines()
+    start = next((i for i, line in enumerate(lines) if " ERRORS " in line), 0)
+    end = next((i for i, line in enumerate(lines) if "short test summary info" in line),
+               len(lines))
+    return ["用例收集失败：\n" + "\n".join(lines[start + 1:end])[-COLLECT_OUTPUT_LIMIT:]]
+
+
+def _check_test_file(file_path: str, content: str) -> str:
+    """写入后立即检查：语法、未定义的名称、导入，都通过后再收集一次用例。
+    返回附在工具结果末尾的诊断文本"""
+    if not file_path.endswith(".py"):
+        return ""
+    from code_checks import check_source
+    problems = check_source(content, file_path, [workspace_dir(), PROJECT_DIR])
+    name = os.path.basename(file_path)
+    if not problems and name.startswith("test_"):
+        problems = _collect_errors(file_path)
+    if not problems:
+        return "\n静态检查通过（语法、名称、导入、用例收集）"
+    return (f"\n\n=== 静态检查发现 {len(problems)} 个问题，请先修复再运行 run_pytest ===\n"
+            + "\n".join(f"  {problem}" for problem in problems))
+
+@registry.tool(
+    "将生成的 pytest 测试代码写入文件。写入后立即检查语法、未定义的名称、导入和用例收集，"
+    "问题会附在结果末尾",
+    params={
+        "file_name": "测试文件名，如 test_users.py",
+        "content": "pytest 测试代码内容"
+    },
+    timeout=30, max_concurrency=1, writes=True
+)
 def write_test_file(file_name: str, content: str) -> str:
     """写入测试文件"""
-    tests_dir = os.path.join(PROJECT_DIR, "tests")
-    os.makedirs(tests_dir, exist_ok=True)
-    
-    file_path = os.path.join(tests_dir, file_name)
     try:
+        file_path = _workspace_path("tests", file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(content)
-        return f"成功：测试文件已写入 - {file_path}"
+        return f"成功：测试文件已写入 - {file_path}" + _check_test_file(file_path, content)
     except Exception as e:
         return f"错误：写入文件失败 - {str(e)}"
 
-def run_pytest(test_file: str = None) -> str:
+class PatchError(Exception):
+    """补丁无法应用（找不到原文、匹配不唯一或上下文冲突）"""
+
+
+def apply_search_replace(content: str, edits: list) -> str:
+    """依次应用 search/replace，每个 search 必须唯一匹配"""
+    for i, edit in enumerate(edits, 1):
+        search, replace = edit.get("search", ""), edit.get("replace", "")
+        if not search:
+            raise PatchError(f"第 {i} 处修改的 search 为空")
+        count = content.count(search)
+        if count == 0:
+            raise PatchError(f"第 {i} 处修改的 search 在文件中不存在")
+        if count > 1:
+            raise PatchError(f"第 {i} 处修改的 search 匹配到 {count} 处，请补充上下文使其唯一")
+        content = content.replace(search, replace, 1)
+    return content
+
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+
+def apply_unified_diff(content: str, diff: str) -> str:
+    """应用 unified diff，行号偏移时在附近查找匹配的上下文；保留原文件的换行符（LF / CRLF）"""
+    hunks = []
+    for line in diff.splitlines():
+        match = _HUNK_HEADER.match(line)
+        if match:
+            hunks.append((int(match.group(1)), [], []))
+        elif hunks and not line.startswith("\\"):
+            old, new = hunks[-1][1], hunks[-1][2]
+            tag, text = (line[:1], line[1:]) if line else (" ", "")
+            if tag in (" ", "-"):
+                old.append(text)
+            if tag in (" ", "+"):
+                new.append(text)
+    if not hunks:
+        raise PatchError("diff 中没有找到 @@ 块")
+
+    newline = "\r\n" if "\r\n" in content else "\n"
+    lines = content.splitlines()
+    offset = 0
+    for n, (start, old, new) in enumerate(hunks, 1):
+        expected = max(start - 1 + offset, 0)
+        candidates = sorted(range(len(lines) - len(old) + 1), key=lambda p: abs(p - expected))
+        pos = next((p for p in candidates if lines[p:p + len(old)] == old), None)
+        if pos is None:
+            raise PatchError(f"第 {n} 个 @@ 块的上下文与文件内容不一致")
+        lines[pos:pos + len(old)] = new
+        offset += len(new) - len(old)
+
+    trailing = newline if content.endswith("\n") or not content else ""
+    return newline.join(lines) + trailing
+
+
+@registry.tool(
+    "以补丁方式修改已有测试文件，只需发送改动部分。"
+    "edits 为 search/replace 列表（search 必须在文件中唯一匹配），"
+    "或用 diff 传入 unified diff。所有改动要么全部生效，要么全部不生效",
+    params={
+        "file_name": "测试文件名，如 test_users.py",
+        "edits": {
+            "description": "替换列表，每项包含 search（原文片段）和 replace（新内容）",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "search": {"type": "string"},
+                    "replace": {"type": "string"}
+                },
+                "required": ["search", "replace"]
+            }
+        },
+        "diff": "unified diff 格式的补丁（与 edits 二选一）"
+    },
+    timeout=30, max_concurrency=1, writes=True
+)
+def edit_test_file(file_name: str, edits: list = None, diff: str = None) -> str:
+    """以补丁方式修改测试文件"""
+    try:
+        file_path = _workspace_path("tests", file_name)
+        # 按原样读取换行符，补丁在 LF 文本上应用，写回时恢复原文件的换行符
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            original = f.read()
+        newline = "\r\n" if "\r\n" in original else "\n"
+        original = original.replace("\r\n", "\n")
+        if edits:
+            updated = apply_search_replace(original, edits)
+        elif diff:
+            updated = apply_unified_diff(original, diff)
+        else:
+            return "错误：edits 和 diff 至少提供一个"
+
+        # 先写临时文件再替换，保证修改是原子的
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline=newline) as f:
+                f.write(updated)
+            # mkstemp 创建的文件权限是 0600，替换前沿用原文件的权限
+            shutil.copymode(file_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        old_lines, new_lines = original.count("\n"), updated.count("\n")
+        return (f"成功：已修改 tests/{file_name}（{old_lines} → {new_lines} 行）"
+                + _check_test_file(file_path, updated))
+    except FileNotFoundError:
+        return f"错误：文件不存在 - tests/{file_name}"
+    except PatchError as e:
+        return f"错误：补丁未应用，文件保持不变 - {e}"
+    except Exception as e:
+        return f"错误：修改文件失败 - {str(e)}"
+
+def _pytest_env() -> dict:
+    env = dict(os.environ)
+    # 独立工作目录下的 conftest.py 需要从项目根目录导入 pytest_api_plugin，
+    # 记录逐条结果的 distributed_runner 插件也从这里导入
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_DIR, env.get("PYTHONPATH")]))
+    env["API_SPEC"] = _spec_in_use()
+    return env
+
+
+def _pytest_main(args: list, env: dict = None, timeout: float = 60) -> tuple:
+    """执行一次 pytest，返回 (退出码, 输出)。
+    默认交给常驻进程 fork 执行，省去解释器启动和依赖导入；不可用时退回子进程。
+    在工具调用中执行时，超时不超过该调用的剩余时间，调用被放弃后 pytest 随之结束"""
+    timeout = time_left(timeout)
+    if timeout <= 0:
+        raise subprocess.TimeoutExpired(["pytest", *args], timeout)
+    root = workspace_dir()
+    args = [*args, f"--rootdir={root}"]
+    env = env if env is not None else dict(os.environ)
+    if env.get("PYTEST_DAEMON", "1") != "0":
+        import pytest_daemon
+        if pytest_daemon.available():
+            try:
+                return pytest_daemon.run(args, env, root, timeout=timeout)
+            except (RuntimeError, OSError):
+                pass
+    result = subprocess.run(
+        ["pytest", *args],
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        cwd=root,
+        env=env
+    )
+    return result.returncode, result.stdout + result.stderr
+
+
+def _pytest(targets: list, env: dict = None) -> str:
+    return _pytest_main([*targets, "-v", "--tb=short"], env)[1]
+
+@registry.tool(
+    "运行 pytest 测试，返回测试结果。失败的用例会自动重跑，"
+    "结果末尾会区分稳定失败、不稳定和已隔离的用例，只需修复稳定失败的用例",
+    params={
+        "test_file": "要运行的测试文件，如 test_users.py。不填则运行全部测试",
+        "record_coverage": "是否记录实际发出的请求，供 coverage_gaps 统计运行时覆盖",
+        "workers": "大于 0 时分布式执行，启动该数量的本地 worker；"
+                   "设置环境变量 DIST_BIND=0.0.0.0:端口 后其他机器上的 worker 也可加入",
+        "reruns": "失败用例的重跑次数，默认 2，0 表示不重跑"
+    },
+    timeout=300, max_concurrency=2
+)
+def run_pytest(test_file: str = None, record_coverage: bool = False, workers: int = 0,
+               reruns: int = DEFAULT_RERUNS) -> str:
     """运行 pytest"""
-    tests_dir = os.path.join(PROJECT_DIR, "tests")
-    
-    if test_file:
-        target = os.path.join(tests_dir, test_file)
-    else:
-        target = tests_dir
-    
+    root = os.path.realpath(workspace_dir())
+    try:
+        target = _workspace_path("tests", test_file or "")
+    except ValueError as e:
+        return f"错误：{e}"
+
+    env = _pytest_env()
+    if record_coverage:
+        # 每次记录覆盖前清空上一次的请求日志
+        log_file = _in_workspace(HTTP_LOG_FILE)
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        open(log_file, 'w').close()
+        env["API_HTTP_LOG"] = log_file
+
+    from run_history import HISTORY_DB, RunHistory, format_regressions, read_report
     try:
-        result = subprocess.run(
-            ["pytest", target, "-v", "--tb=short"],
-            capture_output=True,
-            text=True,
-            timeout=60,
-            cwd=PROJECT_DIR
-        )
-        output = result.stdout + result.stderr
-        return output if output else "测试执行完成，无输出"
+        history = RunHistory(_in_workspace(HISTORY_DB))
+        # 预估耗时只用于分布式执行时按耗时从长到短派发
+        estimates = history.estimates() if workers else None
+    except sqlite3.Error:
+        history, estimates = None, None
+    results = {}
+    start = time.monotonic()
+
+    try:
+        if workers:
+            from distributed_runner import run_distributed
+            output = run_distributed([os.path.relpath(target, root)],
+                                     local_workers=workers,
+                                     bind=os.environ.get("DIST_BIND", "127.0.0.1:0"),
+                                     timeout=time_left(60), root=root, env=env,
+                                     estimates=estimates, on_results=results.update)
+        else:
+            # 首次执行通过 distributed_runner 插件逐条写出结果和耗时，供执行历史使用
+            with tempfile.TemporaryDirectory() as report_dir:
+                report_file = os.path.join(report_dir, "report.jsonl")
+                output = _pytest([target, "-p", "distributed_runner"],
+                                 dict(env, DIST_REPORT_FILE=report_file))
+                results = read_report(report_file)
+        elapsed = time.monotonic() - start
+        if not output:
+            return "测试执行完成，无输出"
+        # 只重跑失败的用例，区分真正的失败和不稳定用例
+        tracker = FlakyTracker(_in_workspace(FLAKY_FILE))
+        output += triage_failures(output, reruns, lambda node_ids: _pytest(node_ids, env), tracker)
+        if history is not None and results:
+            try:
+                run_id = history.record_run(results, root, os.path.relpath(target, root),
+                                            elapsed, workers, env["API_SPEC"])
+                output += format_regressions(history.regressions(run_id))
+            except sqlite3.Error:
+                pass
+        return output
     except subprocess.TimeoutExpired:
         return "错误：测试执行超时（60秒）"
     except FileNotFoundError:
@@ -189,66 +462,237 @@ def run_pytest(test_file: str = None) -> str:
     except Exception as e:
         return f"错误：执行测试失败 - {str(e)}"
 
+@registry.tool(
+    "读取任意文件内容",
+    params={"file_path": "文件路径"},
+    timeout=10, idempotent=True,
+    watch=lambda file_path: _files(file_path)
+)
 def read_file(file_path: str) -> str:
     """读取文件"""
-    full_path = os.path.join(PROJECT_DIR, file_path)
     try:
+        full_path = _workspace_path(file_path)
         with open(full_path, 'r', encoding='utf-8') as f:
             return f.read()
     except Exception as e:
         return f"错误：读取文件失败 - {str(e)}"
 
+def _read_capped(response, max_bytes: int, deadline: float) -> tuple:
+    """流式读取响应体，超过 max_bytes 或超过 deadline 即停止，返回 (内容, 是否截断)"""
+    chunks, size = [], 0
+    for chunk in response.iter_content(chunk_size=8192):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes or time.monotonic() > deadline:
+            return b"".join(chunks)[:max_bytes], True
+    return b"".join(chunks), False
+
+
+def _json_shape(value, depth: int = 0) -> str:
+    """JSON 结构摘要，如 {id: int, tags: [{name: str}] ×3}"""
+    if depth >= 4:
+        return "…"
+    if isinstance(value, dict):
+        fields = [f"{k}: {_json_shape(v, depth + 1)}" for k, v in list(value.items())[:20]]
+        if len(value) > 20:
+            fields.append(f"…共 {len(value)} 个字段")
+        return "{" + ", ".join(fields) + "}"
+    if isinstance(value, list):
+        if not value:
+            return "[]"
+        return f"[{_json_shape(value[0], depth + 1)}] ×{len(value)}"
+    if value is None:
+        return "null"
+    return type(value).__name__
+
+
+def _describe_body(content: bytes, truncated: bool, content_type: str, encoding: str) -> dict:
+    """按 Content-Type 处理响应体：JSON 给结构摘要，文本给预览，二进制只给大小和哈希"""
+    media_type = content_type.split(";")[0].strip().lower()
+    is_json = media_type == "application/json" or media_type.endswith("+json")
+    is_text = is_json or media_type.startswith("text/") or media_type.endswith(("xml", "javascript")) \
+        or media_type in ("application/x-www-form-urlencoded", "")
+
+    if not is_text:
+        described = {"body_type": "binary", "sha256": hashlib.sha256(content).hexdigest()}
+        if truncated:
+            described["sha256_scope"] = f"仅前 {len(content)} 字节"
+        return described
+
+    text = content.decode(encoding or "utf-8", errors="replace")
+    described = {"body_type": "json" if is_json else "text"}
+    if is_json and not truncated:
+        try:
+            described["shape"] = _json_shape(json.loads(text))
+        except ValueError:
+            described["body_type"] = "text"
+    described["body"] = text[:HTTP_BODY_PREVIEW]
+    return described
+
+
+@registry.tool(
+    "发送 HTTP 请求测试接口。响应体流式读取并限制大小：JSON 返回结构摘要和预览，"
+    "二进制只返回大小和哈希，同时返回实际长度和耗时",
+    params={
+        "method": "HTTP 方法：GET, POST, PUT, DELETE",
+        "url": "完整的请求 URL",
+        "headers": "请求头",
+        "body": "请求体（JSON）"
+    },
+    timeout=20, max_concurrency=8
+)
 def send_http_request(method: str, url: str, headers: dict = None, body: dict = None) -> str:
     """发送 HTTP 请求"""
+    import requests
+    start = time.monotonic()
     try:
-        response = requests.request(
+        with requests.request(
             method=method.upper(),
             url=url,
             headers=headers or {},
             json=body,
-            timeout=10
-        )
-        return json.dumps({
-            "status_code": response.status_code,
-            "headers": dict(response.headers),
-            "body": response.text[:2000]  # 限制长度
-        }, indent=2, ensure_ascii=False)
+            timeout=(5, 10),  # 连接 / 读取超时；DNS 解析等其余耗时由注册表的超时兜底
+            stream=True
+        ) as response:
+            header_ms = (time.monotonic() - start) * 1000
+            content, truncated = _read_capped(response, HTTP_BODY_MAX_BYTES,
+                                              start + HTTP_READ_SECONDS)
+            declared = response.headers.get("Content-Length")
+            result = {
+                "status_code": response.status_code,
+                "headers": dict(response.headers),
+                "body_bytes": len(content),
+                "truncated": truncated,
+                "content_length": int(declared) if declared and declared.isdigit() else None,
+                "elapsed_ms": {
+                    "headers": round(header_ms, 1),
+                    "total": round((time.monotonic() - start) * 1000, 1),
+                },
+            }
+            result.update(_describe_body(content, truncated,
+                                         response.headers.get("Content-Type", ""),
+                                         response.encoding))
+        return json.dumps(result, indent=2, ensure_ascii=False)
     except Exception as e:
         return f"错误：请求失败 - {str(e)}"
 
+@registry.tool(
+    "列出目录下的文件",
+    params={"directory": "目录路径，默认为项目根目录"},
+    timeout=10, idempotent=True,
+    watch=lambda directory=None: _files(directory or "")
+)
 def list_files(directory: str = None) -> str:
     """列出目录文件"""
-    target_dir = os.path.join(PROJECT_DIR, directory) if directory else PROJECT_DIR
     try:
-        files = os.listdir(target_dir)
+        files = os.listdir(_workspace_path(directory or ""))
         return "\n".join(files)
     except Exception as e:
         return f"错误：无法列出目录 - {str(e)}"
 
+def _coverage_inputs(spec_path: str, include_recorded: bool = True) -> list:
+    """覆盖矩阵依赖文档、tests/ 下的每个测试文件（目录本身的 mtime 反映增删）和运行时记录"""
+    tests_dir = os.path.join(workspace_dir(), "tests")
+    test_files = sorted(os.path.join("tests", name) for name in os.listdir(tests_dir)
+                        if name.endswith(".py")) if os.path.isdir(tests_dir) else []
+    paths = _files(spec_path, "tests", *test_files)
+    if include_recorded:
+        paths.append(_in_workspace(HTTP_LOG_FILE))
+    return paths
+
+@registry.tool(
+    "统计已有测试对文档接口的覆盖情况（接口 × 状态码 × 参数场景），只列出缺口。"
+    "生成测试前先调用，只为缺口补写用例",
+    params={
+        "spec_path": "Swagger 文件路径，如 swagger/petstore.json",
+        "include_recorded": "是否合并最近一次 run_pytest(record_coverage=true) 记录的实际请求"
+    },
+    timeout=30, idempotent=True, watch=_coverage_inputs,
+    on_call=lambda spec_path, **_: _use_spec(spec_path)
+)
+def coverage_gaps(spec_path: str, include_recorded: bool = True) -> str:
+    """统计覆盖缺口"""
+    try:
+        matrix = build_matrix(load_spec(_workspace_path(spec_path)), _workspace_path("tests"),
+                              include_recorded,
+                              _in_workspace(HTTP_LOG_FILE))
+        return format_gaps(matrix)
+    except FileNotFoundError:
+        return f"错误：文件不存在 - {spec_path}"
+    except Exception as e:
+        return f"错误：统计覆盖失败 - {str(e)}"
+
+@registry.tool(
+    "基于文档对接口做模糊测试：按参数和请求体 schema 生成边界值、非法值、缺失必填项等大量用例并发发送，"
+    "返回去重后的失败特征（5xx、响应不符合文档、非法输入被接受、未定义的状态码）。"
+    "适合在手写用例之外发现参数校验缺口，可把发现的问题补写成 pytest 用例。"
+    "只对本机服务（localhost / 127.0.0.1）执行，不会使用文档 servers 中的地址",
+    params={
+        "spec_path": "Swagger 文件路径，如 swagger/petstore.json",
+        "base_url": "被测服务地址，如 http://127.0.0.1:8000，默认取环境变量 API_BASE_URL；"
+                    "必须是本机地址，除非设置了环境变量 FUZZ_ALLOW_REMOTE=1",
+        "operations": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "只测试这些接口（operationId 或 \"GET /path\"），不填则测试全部"
+        },
+        "max_cases": "每个接口的用例数上限，默认 200",
+        "concurrency": "并发请求数，默认 32"
+    },
+    timeout=300, max_concurrency=1,
+    on_call=lambda spec_path, **_: _use_spec(spec_path)
+)
+def fuzz_api(spec_path: str, base_url: str = None, operations: list = None, max_cases: int = 200,
+             concurrency: int = 32) -> str:
+    """模糊测试"""
+    from api_fuzzer import fuzz
+    try:
+        spec = load_spec(_workspace_path(spec_path))
+        # 远程地址只能由运行 Agent 的人通过环境变量放开，模型不能自行开启
+        return fuzz(spec, base_url or os.environ.get("API_BASE_URL"), operations, max_cases,
+                    concurrency, allow_remote=os.environ.get("FUZZ_ALLOW_REMOTE") == "1",
+                    cancel=cancel_event())
+    except FileNotFoundError:
+        return f"错误：文件不存在 - {spec_path}"
+    except Exception as e:
+        return f"错误：模糊测试失败 - {str(e)}"
+
+def _history_files(**_) -> list:
+    from run_history import HISTORY_DB
+    db = _in_workspace(HISTORY_DB)
+    # WAL 模式下新写入先落在 -wal 文件里
+    return [db, db + "-wal"]
+
+@registry.tool(
+    "查看 run_pytest 的执行历史：各用例的耗时中位数、最近一次耗时、通过率和耗时走势，"
+    "按耗时从高到低排列，用于定位慢用例和越跑越慢的用例",
+    params={
+        "test_filter": "只看节点 ID 包含该字符串的用例，如 test_users.py 或 test_create",
+        "limit": "最多列出的用例数，默认 20"
+    },
+    timeout=10, idempotent=True, watch=_history_files
+)
+def test_history(test_filter: str = None, limit: int = 20) -> str:
+    """查看执行历史"""
+    from run_history import HISTORY_DB, RunHistory, format_trends
+    try:
+        history = RunHistory(_in_workspace(HISTORY_DB))
+        return format_trends(history.trends(test_filter, limit), history.run_count())
+    except Exception as e:
+        return f"错误：读取执行历史失败 - {str(e)}"
+
 # ============================================================
 # 3. 工具执行器
 # ============================================================
 
-def execute_tool(name: str, input_data: dict) -> str:
-    """执行工具"""
-    if name == "read_swagger":
-        return read_swagger(input_data["file_path"])
-    elif name == "write_test_file":
-        return write_test_file(input_data["file_name"], input_data["content"])
-    elif name == "run_pytest":
-        return run_pytest(input_data.get("test_file"))
-    elif name == "read_file":
-        return read_file(input_data["file_path"])
-    elif name == "send_http_request":
-        return send_http_request(
-            input_data["method"],
-            input_data["url"],
-            input_data.get("headers"),
-            input_data.get("body")
-        )
-    elif name == "list_files":
-        return list_files(input_data.get("directory"))
-    return "未知工具"
+def execute_tool(name: str, input_data: dict, cache: ToolResultCache = None,
+                 profiler=None) -> str:
+    """执行工具（超时、并发限制和会话内结果缓存由注册表负责）；
+    profiler 为 agent_profiler.AgentProfiler 时记录本次调用的剖析数据"""
+    return registry.execute(name, input_data, cache, profiler)
+
+# 传给 Claude 的工具定义
+tools = registry.schemas()
 
 # ============================================================
 # 4. Agent 主循环
@@ -263,46 +707,93 @@ SYSTEM_PROMPT = """你是一个专业的接口自动化测试 Agent。你的任
 
 生成测试代码时请遵循以下规范：
 - 使用 pytest 框架
-- 使用 requests 库发送请求
+- 使用 tests/conftest.py 提供的会话级 fixtures，不要自建 requests.Session 或硬编码 BASE_URL：
+  - api_session：共享连接池的 HTTP 客户端，可直接请求 "/pet" 这样的相对路径
+  - base_url：取自当前文档（最近一次 read_swagger 读取的文档）的 servers，可用环境变量 API_BASE_URL 覆盖
+  - require_server：服务不可用时自动跳过，不要在用例里自行发请求探测
+  - api_resources.ensure(path, payload, cleanup_path)：共享测试数据，同一数据只创建一次
+  - assert_matches_schema(operation, status, body)：按文档 components/schemas 校验响应体，
+    operation 可写 operationId（如 getPetById）或 "GET /pet/{petId}"
 - 每个接口至少包含：正常请求测试、参数校验测试
 - 测试函数命名：test_<接口名>_<场景>
 - 添加清晰的中文注释
 - 使用 assert 进行断言
 
+生成测试前先调用 coverage_gaps，只为尚未覆盖的状态码和参数场景补写用例，不要重复生成已有用例
+
+修复已有测试时：
+- 优先使用 edit_test_file 只提交改动部分，不要用 write_test_file 重写整个文件
+- 只修复 run_pytest 报告中"稳定失败"的用例，"不稳定"和"已隔离"的用例不要修改
+
 文件结构：
 - swagger/ 目录存放 Swagger 文档
 - tests/ 目录存放测试代码
 """
 
-def run_agent(user_message: str, max_turns: int = 15):
-    """运行 Agent"""
+def _make_profiler(profile):
+    """profile 为 True 或输出目录时开启剖析；未指定时看环境变量 AGENT_PROFILE"""
+    setting = profile or os.environ.get("AGENT_PROFILE")
+    if not setting or setting == "0":
+        return None
+    from agent_profiler import AgentProfiler
+    return AgentProfiler(None if setting in (True, "1") else setting)
+
+def run_agent(user_message: str, max_turns: int = 15, workspace: str = None, on_event=None,
+              profile=None):
+    """运行 Agent
+    workspace：本次会话的工作目录，默认为项目根目录
+    on_event：进度回调，接收 {"type": "turn" / "text" / "tool_call" / "tool_result" / ...} 事件
+    profile：True 或输出目录时记录每轮、每次工具调用的剖析数据，见 agent_profiler"""
+    load_env()
+    token = _workspace.set(workspace) if workspace else None
+    profiler = _make_profiler(profile)
+    if profiler is not None:
+        profiler.start()
+    try:
+        return _agent_loop(user_message, max_turns, on_event or (lambda event: None), profiler)
+    finally:
+        if token is not None:
+            _workspace.reset(token)
+        if profiler is not None:
+            print(f"\n{profiler.stop()}")
+
+def _agent_loop(user_message: str, max_turns: int, emit, profiler=None):
     print(f"\n{'='*60}")
     print(f"用户指令: {user_message}")
     print('='*60)
     
     messages = [{"role": "user", "content": user_message}]
+    # 本次会话的工具结果缓存：重复读取未变化的文件时只返回引用
+    cache = ToolResultCache()
     
     turn = 0
     while turn < max_turns:
         turn += 1
+        cache.turn = turn
         print(f"\n--- 第 {turn} 轮 ---")
+        emit({"type": "turn", "turn": turn})
         
         # 调用 Claude
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            system=SYSTEM_PROMPT,
-            tools=tools,
-            messages=messages
-        )
+        if profiler is not None:
+            profiler.record_messages(turn, messages)
+        with profiler.model_call(turn) if profiler is not None else nullcontext():
+            response = get_shared_client(get_client).create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=4096,
+                system=SYSTEM_PROMPT,
+                tools=tools,
+                messages=messages
+            )
         
         print(f"状态: {response.stop_reason}")
+        emit({"type": "model", "turn": turn, "stop_reason": response.stop_reason})
         
         # 结束
         if response.stop_reason == "end_turn":
             for block in response.content:
                 if block.type == "text":
                     print(f"\n🤖 Agent 回复:\n{block.text}")
+                    emit({"type": "reply", "text": block.text})
             break
         
         # 处理响应
@@ -313,10 +804,12 @@ def run_agent(user_message: str, max_turns: int = 15):
             if block.type == "text":
                 print(f"💭 思考: {block.text[:200]}..." if len(block.text) > 200 else f"💭 思考: {block.text}")
                 assistant_content.append({"type": "text", "text": block.text})
+                emit({"type": "text", "text": block.text})
             
             elif block.type == "tool_use":
                 print(f"🔧 调用工具: {block.name}")
                 print(f"   参数: {json.dumps(block.input, ensure_ascii=False)[:200]}...")
+                emit({"type": "tool_call", "tool": block.name, "input": block.input})
                 
                 assistant_content.append({
                     "type": "tool_use",
@@ -326,9 +819,12 @@ def run_agent(user_message: str, max_turns: int = 15):
                 })
                 
                 # 执行工具
-                result = execute_tool(block.name, block.input)
+                started = time.monotonic()
+                result = execute_tool(block.name, block.input, cache, profiler)
                 result_preview = result[:300] + "..." if len(result) > 300 else result
                 print(f"   结果: {result_preview}")
+                emit({"type": "tool_result", "tool": block.name, "preview": result_preview,
+                      "elapsed_ms": round((time.monotonic() - started) * 1000)})
                 
                 tool_results.append({
                     "type": "tool_result",
@@ -343,6 +839,7 @@ def run_agent(user_message: str, max_turns: int = 15):
     
     if turn >= max_turns:
         print(f"\n⚠️ 达到最大轮次 ({max_turns})，停止执行")
+        emit({"type": "max_turns", "max_turns": max_turns})
     
     return messages
 
@@ -0,0 +1,95 @@
+"""
+启动耗时基准
+用 python -X importtime 测量导入 api_test_agent 的耗时，并测量一个全新解释器
+导入 Agent 并执行一次工具调用的耗时（批量 / 并行模式下每个 worker 的启动成本）。
+超出阈值或导入了不该在启动时加载的重量级依赖时以非 0 状态退出，可用于 CI 守护。
+
+用法：python bench_startup.py [--runs 5] [--import-budget-ms 150] [--worker-budget-ms 400]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 这些模块只应在第一次调用模型 / 发请求时导入
+DEFERRED_MODULES = ("anthropic", "requests", "dotenv", "yaml")
+
+WORKER_SNIPPET = "import api_test_agent; api_test_agent.execute_tool('list_files', {})"
+
+
+def _clean_env() -> dict:
+    # 去掉 API Key，确保导入阶段不依赖它
+    env = dict(os.environ)
+    env.pop("ANTHROPIC_API_KEY", None)
+    return env
+
+
+def measure_import() -> tuple:
+    """返回 (api_test_agent 累计导入耗时 ms, 启动阶段导入的顶层模块集合)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api_test_agent"],
+        capture_output=True, text=True, cwd=PROJECT_DIR, env=_clean_env(), check=True
+    )
+    cumulative_us, modules = None, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue  # 表头
+        modules.add(name.split(".")[0])
+        if name == "api_test_agent":
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, modules
+
+
+def measure_worker() -> float:
+    """全新解释器导入 Agent 并执行一次工具调用的墙钟耗时 ms"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", WORKER_SNIPPET], capture_output=True,
+                   cwd=PROJECT_DIR, env=_clean_env(), check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="启动耗时基准")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=150)
+    parser.add_argument("--worker-budget-ms", type=float, default=400)
+    args = parser.parse_args()
+
+    import_times, worker_times, loaded = [], [], set()
+    for _ in range(args.runs):
+        elapsed, modules = measure_import()
+        import_times.append(elapsed)
+        loaded |= modules
+        worker_times.append(measure_worker())
+
+    import_ms = statistics.median(import_times)
+    worker_ms = statistics.median(worker_times)
+    eager = sorted(set(DEFERRED_MODULES) & loaded)
+
+    print(f"导入 api_test_agent：中位数 {import_ms:.1f} ms（预算 {args.import_budget_ms:.0f} ms）")
+    print(f"worker 启动 + 一次工具调用：中位数 {worker_ms:.1f} ms（预算 {args.worker_budget_ms:.0f} ms）")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append("导入耗时超出预算")
+    if worker_ms > args.worker_budget_ms:
+        failures.append("worker 启动耗时超出预算")
+    if eager:
+        failures.append(f"启动时导入了应延迟加载的模块: {', '.join(eager)}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ 启动耗时在预算内")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
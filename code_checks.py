@@ -0,0 +1,278 @@
+"""
+测试代码静态检查
+write_test_file / edit_test_file 写入后立即在进程内检查，把问题随工具结果一起返回，
+不用等一整轮 run_pytest 才发现语法错误或拼错的名称：
+- 语法：ast.parse
+- 未定义的名称：按作用域（模块 / 函数 / 类 / 推导式）解析每个读取的名称，
+  找不到绑定也不是内置名称即报告，附带拼写相近的候选
+- 导入：按 pytest 执行时的搜索路径查找模块文件，不执行被导入的模块
+
+只报告确定的问题：出现 from x import * 时不检查未定义的名称；被 except ImportError
+保护的可选导入（try: import ujson as json / except ImportError: import json）不检查。
+"""
+import ast
+import builtins
+import difflib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+_MODULE_NAMES = {"__name__", "__file__", "__doc__", "__spec__", "__loader__", "__package__",
+                 "__builtins__", "__annotations__", "__path__", "__dict__"}
+
+
+class _Scope:
+
+    def __init__(self, parent=None, is_class: bool = False, is_comprehension: bool = False):
+        self.parent = parent
+        self.is_class = is_class
+        self.is_comprehension = is_comprehension
+        self.names = set()
+
+
+class _NameCollector:
+    """遍历语法树，记录每个作用域绑定的名称和读取名称的位置"""
+
+    def __init__(self):
+        self.module = _Scope()
+        self.loads = []          # (作用域, 名称, 行号)
+        self.star_import = False
+
+    def visit(self, node, scope):
+        method = getattr(self, f"visit_{type(node).__name__}", None)
+        if method is not None:
+            method(node, scope)
+        else:
+            self.generic_visit(node, scope)
+
+    def generic_visit(self, node, scope):
+        for child in ast.iter_child_nodes(node):
+            self.visit(child, scope)
+
+    def visit_Name(self, node, scope):
+        if isinstance(node.ctx, ast.Load):
+            self.loads.append((scope, node.id, node.lineno))
+        else:
+            scope.names.add(node.id)
+
+    def visit_Import(self, node, scope):
+        for alias in node.names:
+            scope.names.add(alias.asname or alias.name.split(".")[0])
+
+    def visit_ImportFrom(self, node, scope):
+        for alias in node.names:
+            if alias.name == "*":
+                self.star_import = True
+            else:
+                scope.names.add(alias.asname or alias.name)
+
+    def visit_Global(self, node, scope):
+        scope.names.update(node.names)
+        self.module.names.update(node.names)
+
+    def visit_Nonlocal(self, node, scope):
+        scope.names.update(node.names)
+
+    def visit_NamedExpr(self, node, scope):
+        # 推导式中的 := 绑定到外层函数作用域
+        target = scope
+        while target.is_comprehension:
+            target = target.parent
+        target.names.add(node.target.id)
+        self.visit(node.value, scope)
+
+    def visit_ExceptHandler(self, node, scope):
+        if node.name:
+            scope.names.add(node.name)
+        self.generic_visit(node, scope)
+
+    def visit_MatchAs(self, node, scope):
+        if node.name:
+            scope.names.add(node.name)
+        self.generic_visit(node, scope)
+
+    def visit_MatchStar(self, node, scope):
+        if node.name:
+            scope.names.add(node.name)
+
+    def visit_MatchMapping(self, node, scope):
+        if node.rest:
+            scope.names.add(node.rest)
+        self.generic_visit(node, scope)
+
+    def _visit_arguments(self, args, outer, inner):
+        """参数默认值和注解在外层求值，参数名绑定在函数作用域"""
+        for default in [*args.defaults, *args.kw_defaults]:
+            if default is not None:
+                self.visit(default, outer)
+        for arg in [*args.posonlyargs, *args.args, args.vararg, *args.kwonlyargs, args.kwarg]:
+            if arg is not None:
+                inner.names.add(arg.arg)
+                if arg.annotation is not None:
+                    self.visit(arg.annotation, outer)
+
+    def _new_scope(self, node, scope, is_class: bool = False):
+        inner = _Scope(scope, is_class)
+        for param in getattr(node, "type_params", ()):
+            inner.names.add(param.name)
+        return inner
+
+    def visit_FunctionDef(self, node, scope):
+        scope.names.add(node.name)
+        for decorator in node.decorator_list:
+            self.visit(decorator, scope)
+        if node.returns is not None:
+            self.visit(node.returns, scope)
+        inner = self._new_scope(node, scope)
+        self._visit_arguments(node.args, scope, inner)
+        for statement in node.body:
+            self.visit(statement, inner)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node, scope):
+        inner = _Scope(scope)
+        self._visit_arguments(node.args, scope, inner)
+        self.visit(node.body, inner)
+
+    def visit_ClassDef(self, node, scope):
+        scope.names.add(node.name)
+        for child in [*node.decorator_list, *node.bases, *node.keywords]:
+            self.visit(child, scope)
+        inner = self._new_scope(node, scope, is_class=True)
+        for statement in node.body:
+            self.visit(statement, inner)
+
+    def _visit_comprehension(self, node, scope, elements):
+        inner = _Scope(scope, is_comprehension=True)
+        for i, generator in enumerate(node.generators):
+            # 第一个迭代对象在外层作用域求值
+            self.visit(generator.iter, scope if i == 0 else inner)
+            self.visit(generator.target, inner)
+            for condition in generator.ifs:
+                self.visit(condition, inner)
+        for element in elements:
+            self.visit(element, inner)
+
+    def visit_ListComp(self, node, scope):
+        self._visit_comprehension(node, scope, [node.elt])
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node, scope):
+        self._visit_comprehension(node, scope, [node.key, node.value])
+
+
+def _visible_names(scope, own: bool = True) -> set:
+    names = set()
+    while scope is not None:
+        # 类作用域中的名称只在类体内直接可见，方法中不可见
+        if own or not scope.is_class:
+            names |= scope.names
+        scope, own = scope.parent, False
+    return names
+
+
+def undefined_names(tree) -> list:
+    """返回 [(行号, 名称, 候选名称)]，同一名称只报告第一次出现"""
+    collector = _NameCollector()
+    for statement in tree.body:
+        collector.visit(statement, collector.module)
+    if collector.star_import:
+        return []
+
+    known = set(dir(builtins)) | _MODULE_NAMES
+    found, reported = [], set()
+    for scope, name, lineno in collector.loads:
+        if name in reported or name in known:
+            continue
+        visible = _visible_names(scope)
+        if name not in visible:
+            reported.add(name)
+            # 优先从代码中已有的名称里找拼写相近的
+            suggestion = (difflib.get_close_matches(name, visible, n=1)
+                          or difflib.get_close_matches(name, known, n=1))
+            found.append((lineno, name, suggestion[0] if suggestion else None))
+    return sorted(found)
+
+
+def _module_exists(name: str, search_path: list) -> bool:
+    """按搜索路径逐级查找模块文件；已导入或内置的顶层模块直接视为存在"""
+    top, *rest = name.split(".")
+    if top in sys.modules or top in sys.builtin_module_names:
+        spec = importlib.util.find_spec(top) if rest else None
+    else:
+        spec = importlib.machinery.PathFinder.find_spec(top, [*search_path, *sys.path])
+        if spec is None:
+            return False
+    for part in rest:
+        locations = spec.submodule_search_locations if spec is not None else None
+        if not locations:
+            # 不是包：可能是 from 模块 import 属性 的写法，交给 pytest 收集阶段判断
+            return spec is not None
+        spec = importlib.machinery.PathFinder.find_spec(part, list(locations))
+        if spec is None:
+            return False
+    return True
+
+
+_IMPORT_ERRORS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+
+def _catches_import_error(handler) -> bool:
+    if handler.type is None:
+        return True
+    types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(isinstance(t, ast.Name) and t.id in _IMPORT_ERRORS for t in types)
+
+
+def _guarded_imports(tree) -> set:
+    """try 体中受 except ImportError（或更宽的 except）保护的导入语句"""
+    guarded = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Try, getattr(ast, "TryStar", ast.Try))) \
+                and any(_catches_import_error(handler) for handler in node.handlers):
+            for statement in node.body:
+                guarded.update(id(child) for child in ast.walk(statement)
+                               if isinstance(child, (ast.Import, ast.ImportFrom)))
+    return guarded
+
+
+def unresolved_imports(tree, file_path: str, search_path: list) -> list:
+    """返回 [(行号, 模块名)]，不含可选导入"""
+    found = []
+    guarded = _guarded_imports(tree)
+    for node in ast.walk(tree):
+        if id(node) in guarded:
+            continue
+        if isinstance(node, ast.Import):
+            found += [(node.lineno, alias.name) for alias in node.names
+                      if not _module_exists(alias.name, search_path)]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            if node.level:
+                base = os.path.dirname(os.path.abspath(file_path))
+                for _ in range(node.level - 1):
+                    base = os.path.dirname(base)
+                path = os.path.join(base, *node.module.split("."))
+                if not (os.path.isfile(path + ".py") or os.path.isdir(path)):
+                    found.append((node.lineno, "." * node.level + node.module))
+            elif not _module_exists(node.module, search_path):
+                found.append((node.lineno, node.module))
+    return found
+
+
+def check_source(source: str, file_path: str, search_path: list = ()) -> list:
+    """静态检查测试代码，返回问题描述列表；语法错误时只返回语法错误"""
+    try:
+        tree = ast.parse(source, filename=file_path)
+    except SyntaxError as e:
+        return [f"第 {e.lineno} 行：语法错误 - {e.msg}"]
+
+    problems = []
+    for lineno, module in unresolved_imports(tree, file_path, list(search_path)):
+        problems.append((lineno, f"无法导入模块 {module}"))
+    for lineno, name, suggestion in undefined_names(tree):
+        hint = f"，是否应为 {suggestion}" if suggestion else ""
+        problems.append((lineno, f"未定义的名称 {name}{hint}"))
+    return [f"第 {lineno} 行：{message}" for lineno, message in sorted(problems)]
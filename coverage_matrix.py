@@ -0,0 +1,290 @@
+"""
+接口覆盖矩阵
+把已有测试映射到 文档接口 × 状态码 × 参数场景，只把缺口告诉 Agent，
+避免重复生成已有用例或遗漏未覆盖的分支。
+
+覆盖来源：
+- 静态扫描 tests/ 下的测试文件：HTTP 调用的路径 + status_code 断言 + 用例名中的场景
+- 运行时记录（可选）：run_pytest(record_coverage=True) 时由 pytest_api_plugin
+  把实际发出的请求和返回状态码写入 HTTP_LOG_FILE
+
+参数场景：
+- valid             正常请求
+- missing_required  缺少必填参数 / 请求体字段
+- invalid_value     类型错误、枚举外取值等非法参数
+"""
+import ast
+import json
+import os
+import re
+from urllib.parse import urlsplit
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+HTTP_LOG_FILE = os.path.join(PROJECT_DIR, ".agent_cache", "coverage", "http_calls.jsonl")
+
+_HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+_CASE_KEYWORDS = (
+    ("missing_required", ("missing", "required", "缺少", "必填")),
+    ("invalid_value", ("invalid", "bad", "wrong", "illegal", "无效", "非法", "错误")),
+)
+
+
+def classify_case(test_name: str, docstring: str = "") -> str:
+    text = f"{test_name} {docstring}".lower()
+    for case, keywords in _CASE_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return case
+    return "valid"
+
+
+class OperationIndex:
+    """把实际请求路径匹配回文档中的接口"""
+
+    def __init__(self, spec: dict):
+        self.operations = {}  # op_id -> {"method", "path", "statuses", "cases"}
+        self._routes = []     # (变量段数, method, 正则, op_id)
+        for path, item in spec.get("paths", {}).items():
+            shared = item.get("parameters", [])
+            for method in _HTTP_METHODS:
+                op = item.get(method)
+                if op is None:
+                    continue
+                op_id = op.get("operationId") or f"{method.upper()} {path}"
+                self.operations[op_id] = {
+                    "method": method.upper(),
+                    "path": path,
+                    "statuses": sorted(s for s in op.get("responses", {}) if s.isdigit()),
+                    "cases": self._cases(op, shared),
+                }
+                pattern = "^" + re.sub(r"\\\{[^/]+?\\\}", "[^/]+", re.escape(path)) + "/?$"
+                self._routes.append((path.count("{"), method.upper(), re.compile(pattern), op_id))
+        # 字面量路径优先，/pet/findByStatus 不会被 /pet/{petId} 抢走
+        self._routes.sort(key=lambda route: route[0])
+
+    @staticmethod
+    def _cases(op: dict, shared: list) -> list:
+        params = shared + op.get("parameters", [])
+        cases = ["valid"]
+        # 路径参数缺失时请求的是另一个 URL，不算作该接口的 missing_required
+        required = [p for p in params if p.get("required") and p.get("in") != "path"]
+        if required or op.get("requestBody", {}).get("required"):
+            cases.append("missing_required")
+        if params or "requestBody" in op:
+            cases.append("invalid_value")
+        return cases
+
+    def match(self, method: str, path: str) -> str:
+        """返回匹配的 op_id；method 为空时只按路径匹配"""
+        path = "/" + path.split("?", 1)[0].lstrip("/")
+        for _, route_method, pattern, op_id in self._routes:
+            if method and route_method != method.upper():
+                continue
+            if pattern.match(path):
+                return op_id
+        # 请求路径可能带 base_url 前缀（如 /api/v3/pet），逐段去掉前缀再试
+        parts = path.split("/")
+        if len(parts) > 2:
+            return self.match(method, "/" + "/".join(parts[2:]))
+        return None
+
+
+# ---------- 静态扫描 ----------
+
+def _url_template(node) -> str:
+    """把 URL 参数还原成路径模板，f-string 中的变量替换为 {}"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(str(value.value))
+            else:
+                parts.append("{}")
+        return "".join(parts)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _url_template(node.left), _url_template(node.right)
+        if left is not None or right is not None:
+            return (left or "{}") + (right or "")
+    return None
+
+
+def _strip_base(url: str) -> str:
+    # f"{self.BASE_URL}/pet/{pet_id}" → "/pet/{}"；完整 URL 只取 path
+    if url.startswith("{}"):
+        url = url[2:]
+    if "://" in url:
+        url = urlsplit(url).path
+    return url
+
+
+def _http_calls(func: ast.AST) -> list:
+    """返回 [(行号, METHOD, 路径模板)]"""
+    calls = []
+    for node in ast.walk(func):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        method = node.func.attr.lower()
+        args = list(node.args)
+        if method == "request" and args:
+            first = args.pop(0)
+            method = first.value.lower() if isinstance(first, ast.Constant) else ""
+        elif method not in _HTTP_METHODS:
+            continue
+        url_node = args[0] if args else next(
+            (kw.value for kw in node.keywords if kw.arg == "url"), None)
+        url = _url_template(url_node) if url_node is not None else None
+        if url is not None and ("/" in url or url.startswith("{}")):
+            calls.append((node.lineno, method.upper(), _strip_base(url)))
+    return sorted(calls)
+
+
+def _status_literals(node) -> list:
+    if isinstance(node, ast.Constant) and isinstance(node.value, int):
+        return [str(node.value)]
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return [str(e.value) for e in node.elts
+                if isinstance(e, ast.Constant) and isinstance(e.value, int)]
+    return []
+
+
+def _status_asserts(func: ast.AST) -> list:
+    """返回 [(行号, [状态码])]：assert x.status_code == 200 / in [400, 404]"""
+    found = []
+    for node in ast.walk(func):
+        if not isinstance(node, ast.Compare):
+            continue
+        left = node.left
+        if not (isinstance(left, ast.Attribute) and left.attr == "status_code"):
+            continue
+        if isinstance(node.ops[0], (ast.Eq, ast.In)):
+            statuses = _status_literals(node.comparators[0])
+            if statuses:
+                found.append((node.lineno, statuses))
+    return found
+
+
+def _schema_asserts(func: ast.AST) -> list:
+    """assert_matches_schema("getPetById", 200, body) 直接给出接口和状态码"""
+    found = []
+    for node in ast.walk(func):
+        if not isinstance(node, ast.Call):
+            continue
+        name = getattr(node.func, "id", None) or getattr(node.func, "attr", None)
+        if name not in ("assert_matches_schema", "assert_matches") or len(node.args) < 2:
+            continue
+        op, status = node.args[0], node.args[1]
+        if isinstance(op, ast.Constant) and isinstance(status, ast.Constant):
+            found.append((str(op.value), str(status.value)))
+    return found
+
+
+def scan_test_file(file_path: str, index: OperationIndex) -> list:
+    """静态扫描一个测试文件，返回 [(op_id, 状态码或 None, 场景, 来源)]"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=file_path)
+
+    hits = []
+    rel_path = os.path.relpath(file_path, PROJECT_DIR)
+    for node in ast.walk(tree):
+        if not (isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                and node.name.startswith("test")):
+            continue
+        source = f"{rel_path}::{node.name}"
+        case = classify_case(node.name, ast.get_docstring(node) or "")
+
+        calls = [(line, index.match(method, path)) for line, method, path in _http_calls(node)]
+        calls = [(line, op_id) for line, op_id in calls if op_id]
+        for _, op_id in calls:
+            hits.append((op_id, None, case, source))
+
+        # 状态码断言归属到它之前最近的一次请求
+        for line, statuses in _status_asserts(node):
+            previous = [op_id for call_line, op_id in calls if call_line <= line]
+            if previous:
+                hits.extend((previous[-1], status, case, source) for status in statuses)
+
+        for op_id, status in _schema_asserts(node):
+            if op_id in index.operations:
+                hits.append((op_id, status, case, source))
+    return hits
+
+
+# ---------- 运行时记录 ----------
+
+def load_recorded_calls(index: OperationIndex, log_file: str = HTTP_LOG_FILE) -> list:
+    """读取运行时记录的请求，返回与 scan_test_file 相同格式的命中列表"""
+    hits = []
+    if not os.path.exists(log_file):
+        return hits
+    with open(log_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                call = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            op_id = index.match(call["method"], urlsplit(call["url"]).path)
+            if op_id:
+                test = call.get("test") or ""
+                hits.append((op_id, str(call["status"]), classify_case(test), f"运行时 {test}"))
+    return hits
+
+
+# ---------- 矩阵 ----------
+
+def build_matrix(spec: dict, tests_dir: str, include_recorded: bool = True,
+                 log_file: str = HTTP_LOG_FILE) -> dict:
+    """返回 {op_id: {"method", "path", "statuses": {码: [来源]}, "cases": {场景: [来源]}}}"""
+    index = OperationIndex(spec)
+    matrix = {
+        op_id: {
+            "method": op["method"],
+            "path": op["path"],
+            "statuses": {status: [] for status in op["statuses"]},
+            "cases": {case: [] for case in op["cases"]},
+        }
+        for op_id, op in index.operations.items()
+    }
+
+    hits = []
+    for root, _, files in os.walk(tests_dir):
+        for name in sorted(files):
+            if name.startswith("test_") and name.endswith(".py"):
+                try:
+                    hits.extend(scan_test_file(os.path.join(root, name), index))
+                except SyntaxError:
+                    continue
+    if include_recorded:
+        hits.extend(load_recorded_calls(index, log_file))
+
+    for op_id, status, case, source in hits:
+        entry = matrix[op_id]
+        if status is not None and status in entry["statuses"]:
+            entry["statuses"][status].append(source)
+        if case in entry["cases"]:
+            entry["cases"][case].append(source)
+    return matrix
+
+
+def format_gaps(matrix: dict) -> str:
+    """紧凑地列出缺口，已完全覆盖的接口只计数不展开"""
+    total = sum(len(e["statuses"]) + len(e["cases"]) for e in matrix.values())
+    covered = sum(
+        sum(1 for s in e["statuses"].values() if s) + sum(1 for c in e["cases"].values() if c)
+        for e in matrix.values()
+    )
+    lines = [f"覆盖 {covered}/{total}（状态码 + 参数场景），{len(matrix)} 个接口"]
+    complete = 0
+    for op_id, entry in matrix.items():
+        missing_status = [s for s, sources in entry["statuses"].items() if not sources]
+        missing_case = [c for c, sources in entry["cases"].items() if not sources]
+        if not missing_status and not missing_case:
+            complete += 1
+            continue
+        done = [s for s, sources in entry["statuses"].items() if sources]
+        line = f"{op_id} {entry['method']} {entry['path']}: "
+        line += f"已覆盖 {','.join(done) or '-'} | 缺状态码 {','.join(missing_status) or '-'}"
+        line += f" | 缺场景 {','.join(missing_case) or '-'}"
+        lines.append(line)
+    lines.append(f"已完全覆盖 {complete} 个接口")
+    return "\n".join(lines)
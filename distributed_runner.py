@@ -0,0 +1,435 @@
+"""
+分布式执行 pytest
+coordinator 收集测试节点 ID，分批派发给通过 TCP 注册的 worker；worker 在自己同步好的
+项目副本中执行并逐条回传结果。worker 断开时，其未完成的用例重新排队分给其他 worker。
+
+协议：每行一个 JSON 消息
+    worker → coordinator  {"type": "register", "worker": 名称, "fingerprint": tests 目录指纹}
+    coordinator → worker  {"type": "batch", "items": [节点 ID, ...]}
+    worker → coordinator  {"type": "result", "nodeid", "outcome", "duration", "longrepr"}
+    worker → coordinator  {"type": "batch_done"}
+    coordinator → worker  {"type": "shutdown"} / {"type": "rejected", "reason"}
+
+tests 目录指纹不一致（副本未同步）的 worker 会被拒绝。
+提供历史耗时（run_history.estimates）时按耗时从长到短派发，长用例单独成批，
+短用例凑够 BATCH_SECONDS 再派发，让各 worker 尽量同时结束。
+
+用法：
+    python distributed_runner.py coordinator --bind 0.0.0.0:9400 [--local-workers 2] [tests/...]
+    python distributed_runner.py worker --connect 10.0.0.5:9400 [--root /path/to/copy]
+
+本模块同时作为 pytest 插件（-p distributed_runner）在 worker 的子进程中记录结果。
+"""
+import argparse
+import hashlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BATCH_SIZE = 5
+MAX_ATTEMPTS = 3          # 同一用例最多派发次数，防止一个用例反复拖垮 worker
+REGISTER_TIMEOUT = 30     # 等待第一个 worker 注册的秒数
+WORKER_IDLE_TIMEOUT = 600 # worker 超过该秒数没有任何消息视为失联，其用例重新分配
+LONGREPR_LIMIT = 2000
+BATCH_SECONDS = 2.0       # 有历史耗时时，一批用例的预估总耗时上限
+COLLECT_TIMEOUT = 60      # pytest --collect-only 的超时秒数
+
+
+# ---------- 消息与公共函数 ----------
+
+def send_message(wfile, message: dict):
+    wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+    wfile.flush()
+
+
+def read_message(rfile):
+    """读取一条消息，连接关闭时返回 None"""
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def tests_fingerprint(root: str, tests_dir: str = "tests") -> str:
+    """tests 目录下所有 .py 文件的路径和内容哈希，用来确认 worker 副本已同步"""
+    digest = hashlib.blake2b(digest_size=16)
+    base = os.path.join(root, tests_dir)
+    for current, dirs, files in os.walk(base):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            path = os.path.join(current, name)
+            digest.update(os.path.relpath(path, root).replace(os.sep, "/").encode("utf-8"))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def collect_node_ids(root: str, targets: list, env: dict = None,
+                     timeout: float = COLLECT_TIMEOUT) -> list:
+    """pytest --collect-only 收集节点 ID，超时抛 subprocess.TimeoutExpired"""
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "--collect-only", "-q", f"--rootdir={root}", *targets],
+        capture_output=True, text=True, cwd=root, env=env, timeout=timeout
+    )
+    return [line.strip() for line in result.stdout.splitlines() if "::" in line]
+
+
+# ---------- pytest 插件：worker 子进程中逐条写出结果 ----------
+
+def pytest_runtest_logreport(report):
+    report_file = os.environ.get("DIST_REPORT_FILE")
+    if not report_file:
+        return
+    if report.when == "call":
+        outcome = report.outcome
+    elif report.failed:
+        outcome = "error"           # setup / teardown 失败
+    elif report.when == "setup" and report.skipped:
+        outcome = "skipped"
+    else:
+        return
+    longrepr = str(report.longrepr)[:LONGREPR_LIMIT] if report.longrepr else ""
+    with open(report_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({
+            "nodeid": report.nodeid,
+            "outcome": outcome,
+            "duration": round(report.duration, 3),
+            "longrepr": longrepr,
+        }, ensure_ascii=False) + "\n")
+
+
+# ---------- coordinator ----------
+
+class Coordinator:
+    """派发测试批次、收集结果、在 worker 失联时重新分配"""
+
+    def __init__(self, node_ids: list, fingerprint: str, host: str = "127.0.0.1", port: int = 0,
+                 batch_size: int = DEFAULT_BATCH_SIZE, estimates: dict = None):
+        self.total = len(node_ids)
+        self.fingerprint = fingerprint
+        self.batch_size = batch_size
+        self.estimates = {}
+        if estimates:
+            # 没有历史的用例按已知用例的平均耗时估计
+            known = [estimates[n] for n in node_ids if n in estimates]
+            default = sum(known) / len(known) if known else 0.0
+            self.estimates = {n: estimates.get(n, default) for n in node_ids}
+            node_ids = sorted(node_ids, key=self.estimates.get, reverse=True)
+        self.pending = deque(node_ids)
+        self.results = {}
+        self.attempts = Counter()
+        self.workers = []
+        self.cond = threading.Condition()
+
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.request.settimeout(WORKER_IDLE_TIMEOUT)
+                coordinator.handle_worker(self.rfile, self.wfile)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def address(self) -> tuple:
+        return self.server.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="coordinator", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def done(self) -> bool:
+        return len(self.results) >= self.total
+
+    def _next_batch(self) -> list:
+        """取下一批；队列空但仍有其他 worker 在执行时等待（它们可能失联需要重排）"""
+        with self.cond:
+            while not self.pending and not self.done():
+                self.cond.wait(0.5)
+            batch, budget = [], 0.0
+            while self.pending and len(batch) < self.batch_size:
+                cost = self.estimates.get(self.pending[0], 0.0)
+                if batch and budget + cost > BATCH_SECONDS:
+                    break
+                budget += cost
+                item = self.pending.popleft()
+                if item not in self.results:
+                    self.attempts[item] += 1
+                    batch.append(item)
+            return batch
+
+    def _record(self, result: dict):
+        with self.cond:
+            self.results[result["nodeid"]] = result
+            self.cond.notify_all()
+
+    def _requeue(self, items, worker: str):
+        with self.cond:
+            for item in items:
+                if item in self.results:
+                    continue
+                if self.attempts[item] >= MAX_ATTEMPTS:
+                    self.results[item] = {
+                        "nodeid": item, "outcome": "error", "duration": 0,
+                        "longrepr": f"执行 {MAX_ATTEMPTS} 次均未返回结果（最后一次在 {worker}）",
+                    }
+                else:
+                    self.pending.appendleft(item)
+            self.cond.notify_all()
+
+    def handle_worker(self, rfile, wfile):
+        hello = read_message(rfile)
+        if not hello or hello.get("type") != "register":
+            return
+        worker = hello.get("worker", "unknown")
+        if hello.get("fingerprint") != self.fingerprint:
+            send_message(wfile, {"type": "rejected", "reason": "tests 目录与 coordinator 不一致，请先同步"})
+            return
+        with self.cond:
+            self.workers.append(worker)
+            self.cond.notify_all()
+
+        in_flight = set()
+        try:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    send_message(wfile, {"type": "shutdown"})
+                    return
+                in_flight = set(batch)
+                send_message(wfile, {"type": "batch", "items": batch})
+                while True:
+                    message = read_message(rfile)
+                    if message is None:
+                        return                      # 断开，finally 中重排
+                    if message["type"] == "result":
+                        message.pop("type")
+                        self._record(message)
+                        in_flight.discard(message["nodeid"])
+                    elif message["type"] == "batch_done":
+                        # 没有回传结果的用例（如收集失败）重新排队
+                        self._requeue(in_flight, worker)
+                        in_flight = set()
+                        break
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._requeue(in_flight, worker)
+
+    def wait(self, timeout: float = None, register_timeout: float = REGISTER_TIMEOUT) -> bool:
+        """等待全部结果；超时或始终没有 worker 注册时返回 False"""
+        start = time.monotonic()
+        with self.cond:
+            while not self.done():
+                elapsed = time.monotonic() - start
+                if not self.workers and elapsed > register_timeout:
+                    return False
+                if timeout is not None and elapsed > timeout:
+                    return False
+                self.cond.wait(0.5)
+        return True
+
+
+# ---------- worker ----------
+
+def run_batch(root: str, node_ids: list):
+    """在 root 下执行一批用例，边执行边产出结果"""
+    fd, report_file = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    env = dict(os.environ, DIST_REPORT_FILE=report_file)
+    # -p distributed_runner 从本模块所在目录导入：远程 worker 的 root 可能只是同步过去的 tests 副本
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get("PYTHONPATH")]))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "pytest", "-p", "distributed_runner", "-q", "--tb=short",
+         "-p", "no:cacheprovider", f"--rootdir={root}", *node_ids],
+        cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with open(report_file, 'r', encoding='utf-8') as f:
+            buffer = ""
+            while True:
+                chunk = f.readline()
+                if chunk:
+                    buffer += chunk
+                    if buffer.endswith("\n"):
+                        yield json.loads(buffer)
+                        buffer = ""
+                elif process.poll() is not None:
+                    rest = f.read()
+                    for line in (buffer + rest).splitlines():
+                        if line.strip():
+                            yield json.loads(line)
+                    break
+                else:
+                    time.sleep(0.05)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        os.remove(report_file)
+
+
+def run_worker(host: str, port: int, root: str = PROJECT_DIR, name: str = None) -> int:
+    """连接 coordinator，执行派发的批次直到收到 shutdown"""
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    # 被 SIGTERM 结束时走正常退出流程，run_batch 的 finally 会结束正在执行的 pytest 子进程
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    with socket.create_connection((host, port)) as sock:
+        rfile, wfile = sock.makefile("rb"), sock.makefile("wb")
+        send_message(wfile, {"type": "register", "worker": name,
+                             "fingerprint": tests_fingerprint(root)})
+        while True:
+            message = read_message(rfile)
+            if message is None or message["type"] == "shutdown":
+                return 0
+            if message["type"] == "rejected":
+                print(f"worker {name} 被拒绝：{message['reason']}", file=sys.stderr)
+                return 1
+            if message["type"] == "batch":
+                for result in run_batch(root, message["items"]):
+                    send_message(wfile, {"type": "result", **result})
+                send_message(wfile, {"type": "batch_done"})
+
+
+# ---------- 入口 ----------
+
+def format_results(results: dict, elapsed: float, workers: list, incomplete: bool = False) -> str:
+    """仿照 pytest -v 的输出格式汇总结果"""
+    lines, counts = [], Counter()
+    for nodeid in sorted(results):
+        result = results[nodeid]
+        counts[result["outcome"]] += 1
+        lines.append(f"{nodeid} {result['outcome'].upper()}")
+    for nodeid in sorted(results):
+        result = results[nodeid]
+        if result["outcome"] in ("failed", "error") and result["longrepr"]:
+            lines.append(f"\n___ {nodeid} ___\n{result['longrepr']}")
+    summary = ", ".join(f"{n} {outcome}" for outcome, n in sorted(counts.items()))
+    lines.append(f"\n{summary or '没有执行任何用例'} in {elapsed:.2f}s"
+                 f"（{len(workers)} 个 worker：{', '.join(workers) or '-'}）")
+    if incomplete:
+        lines.append("⚠️ 未能在限定时间内完成全部用例")
+    return "\n".join(lines)
+
+
+def _wait_all(processes: list, timeout: float):
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(timeout=max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def _stop_workers(processes: list, finished: bool, grace: float = 5):
+    """结束本地 worker。正常完成时先等它们收到 shutdown 自行退出；超时未完成时直接发 SIGTERM，
+    worker 会清理正在执行的 pytest 子进程；最后结束整个进程组，不留下仍在请求接口的孤儿进程"""
+    if finished:
+        _wait_all(processes, grace)
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    _wait_all(processes, grace)
+    for process in processes:
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        elif process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def run_distributed(targets: list, local_workers: int = 2, bind: str = "127.0.0.1:0",
+                    batch_size: int = DEFAULT_BATCH_SIZE, timeout: float = None,
+                    root: str = PROJECT_DIR, env: dict = None, estimates: dict = None,
+                    on_results=None) -> str:
+    """启动 coordinator 和若干本地 worker 执行测试，返回汇总文本。
+    bind 为 0.0.0.0:端口 时，其他机器上的 worker 也可以注册进来；env 传给本地 worker。
+    estimates 为 {节点 ID: 预估秒数} 时按耗时从长到短派发；on_results 接收逐条结果"""
+    start = time.monotonic()
+    # 收集耗时计入总超时
+    collect_timeout = COLLECT_TIMEOUT if timeout is None else min(timeout, COLLECT_TIMEOUT)
+    try:
+        node_ids = collect_node_ids(root, targets, env, collect_timeout)
+    except subprocess.TimeoutExpired:
+        return f"错误：收集用例超时（{collect_timeout:g}秒）"
+    if not node_ids:
+        return "没有收集到测试用例"
+    if timeout is not None:
+        timeout = max(timeout - (time.monotonic() - start), 0)
+
+    host, port = bind.rsplit(":", 1)
+    coordinator = Coordinator(node_ids, tests_fingerprint(root), host, int(port), batch_size,
+                              estimates)
+    coordinator.start()
+    connect_host = "127.0.0.1" if host in ("0.0.0.0", "") else host
+    _, actual_port = coordinator.address
+
+    # 每个本地 worker 单独一个进程组，超时时连同它启动的 pytest 子进程一起结束
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker",
+             "--connect", f"{connect_host}:{actual_port}", "--root", root,
+             "--name", f"local-{i + 1}"],
+            cwd=root, env=env, start_new_session=True
+        )
+        for i in range(local_workers)
+    ]
+    finished = False
+    try:
+        finished = coordinator.wait(timeout)
+    finally:
+        coordinator.stop()
+        _stop_workers(processes, finished)
+    if on_results is not None:
+        on_results(dict(coordinator.results))
+    return format_results(coordinator.results, time.monotonic() - start,
+                          coordinator.workers, incomplete=not finished)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="分布式执行 pytest")
+    sub = parser.add_subparsers(dest="role", required=True)
+
+    coord = sub.add_parser("coordinator", help="收集并派发用例")
+    coord.add_argument("--bind", default="0.0.0.0:9400")
+    coord.add_argument("--local-workers", type=int, default=0)
+    coord.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    coord.add_argument("--timeout", type=float)
+    coord.add_argument("targets", nargs="*", default=["tests"])
+
+    work = sub.add_parser("worker", help="注册到 coordinator 并执行用例")
+    work.add_argument("--connect", required=True, help="coordinator 地址 host:port")
+    work.add_argument("--root", default=PROJECT_DIR, help="项目副本根目录")
+    work.add_argument("--name")
+
+    args = parser.parse_args()
+    if args.role == "worker":
+        host, port = args.connect.rsplit(":", 1)
+        return run_worker(host, int(port), args.root, args.name)
+
+    print(run_distributed(args.targets, args.local_workers, args.bind, args.batch_size,
+                          args.timeout))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
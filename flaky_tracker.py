@@ -0,0 +1,138 @@
+"""
+不稳定用例识别
+run_pytest 失败后只重跑失败的用例：重跑通过的判定为不稳定（flaky），每次都失败的才是
+真正需要修复的失败。每个用例的执行次数和不稳定次数持久化到 FLAKY_FILE，历史不稳定率
+超过阈值的用例被隔离：不再重跑，失败也不计入修复范围。
+"""
+import json
+import os
+import re
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+FLAKY_FILE = os.path.join(PROJECT_DIR, ".agent_cache", "flaky.json")
+
+QUARANTINE_RATE = 0.2   # 不稳定率达到该值即隔离
+QUARANTINE_MIN_RUNS = 3 # 至少执行过这么多次才判断，避免一次偶发就被隔离
+
+# pytest -v：tests/x.py::T::test_a PASSED [ 10%]；分布式汇总：tests/x.py::T::test_a FAILED
+_RESULT_LINE = re.compile(r"^(\S+::\S+) (PASSED|FAILED|ERROR|SKIPPED|XFAIL|XPASS)\b")
+# 简要汇总：FAILED tests/x.py::T::test_a - AssertionError
+_SUMMARY_LINE = re.compile(r"^(FAILED|ERROR) (\S+::\S+)")
+
+
+def parse_outcomes(output: str) -> dict:
+    """从 pytest 输出中解析 {节点 ID: passed/failed/skipped}"""
+    outcomes = {}
+    for line in output.splitlines():
+        match = _RESULT_LINE.match(line)
+        if match:
+            outcomes[match.group(1)] = _normalize(match.group(2))
+            continue
+        match = _SUMMARY_LINE.match(line)
+        if match:
+            outcomes[match.group(2)] = "failed"
+    return outcomes
+
+
+def _normalize(status: str) -> str:
+    if status in ("FAILED", "ERROR"):
+        return "failed"
+    if status in ("SKIPPED", "XFAIL"):
+        return "skipped"
+    return "passed"
+
+
+class FlakyTracker:
+    """每个用例的执行次数 / 失败次数 / 不稳定次数"""
+
+    def __init__(self, path: str = FLAKY_FILE):
+        self.path = path
+        self.stats = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.stats = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self.stats = {}
+
+    def _entry(self, nodeid: str) -> dict:
+        return self.stats.setdefault(nodeid, {"runs": 0, "failures": 0, "flaky": 0})
+
+    def flaky_rate(self, nodeid: str) -> float:
+        entry = self.stats.get(nodeid)
+        if not entry or not entry["runs"]:
+            return 0.0
+        return entry["flaky"] / entry["runs"]
+
+    def is_quarantined(self, nodeid: str) -> bool:
+        entry = self.stats.get(nodeid)
+        return bool(entry) and entry["runs"] >= QUARANTINE_MIN_RUNS \
+            and self.flaky_rate(nodeid) >= QUARANTINE_RATE
+
+    def record_run(self, outcomes: dict, rerun_passed: set, rerun_failed: set):
+        """记录一次 run_pytest：outcomes 为首轮结果，rerun_* 为重跑后的分类"""
+        now = int(time.time())
+        for nodeid, outcome in outcomes.items():
+            if outcome == "skipped":
+                continue
+            entry = self._entry(nodeid)
+            entry["runs"] += 1
+            entry["last_run"] = now
+            if nodeid in rerun_passed:
+                entry["flaky"] += 1
+            elif nodeid in rerun_failed or outcome == "failed":
+                entry["failures"] += 1
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.stats, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+def triage_failures(output: str, reruns: int, rerun, tracker: FlakyTracker = None) -> str:
+    """对首轮失败的用例重跑 reruns 次并分类，返回追加到 pytest 输出后的报告。
+    rerun(node_ids) 执行给定用例并返回 pytest 输出"""
+    tracker = tracker or FlakyTracker()
+    outcomes = parse_outcomes(output)
+    failed = [nodeid for nodeid, outcome in outcomes.items() if outcome == "failed"]
+    quarantined = [nodeid for nodeid in failed if tracker.is_quarantined(nodeid)]
+    remaining = [nodeid for nodeid in failed if nodeid not in quarantined]
+
+    flaky = set()
+    for _ in range(reruns):
+        if not remaining:
+            break
+        rerun_outcomes = parse_outcomes(rerun(remaining))
+        passed = {nodeid for nodeid in remaining if rerun_outcomes.get(nodeid) == "passed"}
+        flaky |= passed
+        remaining = [nodeid for nodeid in remaining if nodeid not in passed]
+
+    consistent = set(remaining) if reruns else set()
+    tracker.record_run(outcomes, flaky, consistent)
+    tracker.save()
+
+    if not failed:
+        return ""
+    lines = [f"\n=== 失败用例重跑 {reruns} 次后的分类 ==="]
+    if consistent:
+        lines.append("稳定失败（需要修复）：")
+        lines.extend(f"  {nodeid}" for nodeid in sorted(consistent))
+    elif remaining:
+        lines.append("未重跑的失败：")
+        lines.extend(f"  {nodeid}" for nodeid in sorted(remaining))
+    if flaky:
+        lines.append("不稳定（重跑通过，不要修改这些用例）：")
+        lines.extend(f"  {nodeid}（历史不稳定率 {tracker.flaky_rate(nodeid):.0%}）"
+                     for nodeid in sorted(flaky))
+    if quarantined:
+        lines.append("已隔离（历史上经常不稳定，失败不计入修复范围）：")
+        lines.extend(f"  {nodeid}（历史不稳定率 {tracker.flaky_rate(nodeid):.0%}）"
+                     for nodeid in sorted(quarantined))
+    return "\n".join(lines)
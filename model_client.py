@@ -0,0 +1,179 @@
+"""
+限流感知的模型客户端
+同一进程内的所有 Agent 会话共用一个 RateLimitedClient：
+- 令牌桶：按每分钟请求数（RPM）和每分钟 token 数（TPM）限速
+- 遇到 429 / 529：优先按 retry-after 等待，否则指数退避 + 随机抖动后重试；
+  5xx 和连接错误同样退避重试，但不收缩并发（重试统一在这里做，SDK 自身的重试需关闭）
+- AIMD 自适应并发：成功时并发上限缓慢增加，被限流时减半
+
+环境变量：
+- ANTHROPIC_RPM          每分钟请求数上限，默认 50
+- ANTHROPIC_TPM          每分钟 token 数上限（输入 + 输出），默认 80000
+- ANTHROPIC_MAX_RETRIES  限流 / 过载时的最大重试次数，默认 6
+"""
+import json
+import os
+import random
+import threading
+import time
+
+THROTTLE_STATUS = (429, 529)                 # 限流 / 过载：重试并收缩并发
+RETRYABLE_STATUS = THROTTLE_STATUS + (500, 502, 503, 504)
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+class TokenBucket:
+    """每分钟补充 capacity 个令牌的令牌桶，允许短暂欠账（按实际用量事后结算）"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float):
+        """取 amount 个令牌，不足时阻塞；超过桶容量的请求按容量计算，避免永远等不到"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, delta: float):
+        """按实际用量修正：delta > 0 表示多用了，< 0 表示预估多扣了"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AdaptiveLimiter:
+    """AIMD 并发控制：成功 +1/limit，被限流时减半"""
+
+    def __init__(self, initial: float = 4, minimum: float = 1, maximum: float = 32):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        self._last_decrease = 0.0
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                # 同一波限流只减半一次，避免并发中的多个请求连续把上限压到底
+                now = time.monotonic()
+                if now - self._last_decrease > 1.0:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+def estimate_request_tokens(kwargs: dict) -> int:
+    """粗略估算一次请求的 token 数：输入约 3 字符一个 token，加上 max_tokens"""
+    size = len(kwargs.get("system", "") or "")
+    size += len(json.dumps(kwargs.get("messages", []), ensure_ascii=False, default=str))
+    size += len(json.dumps(kwargs.get("tools", []), ensure_ascii=False))
+    return size // 3 + kwargs.get("max_tokens", 0)
+
+
+def retry_after(error) -> float:
+    """从错误响应头读取建议的等待秒数，没有则返回 None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class RateLimitedClient:
+    """包装 anthropic 客户端的 messages.create，加上限速、重试和自适应并发"""
+
+    def __init__(self, client_factory, rpm: float, tpm: float, max_retries: int):
+        self._client_factory = client_factory
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveLimiter()
+        self.max_retries = max_retries
+
+    def create(self, **kwargs):
+        """参数与 client.messages.create 相同"""
+        import anthropic
+
+        client = self._client_factory()
+        estimated = estimate_request_tokens(kwargs)
+        attempt = 0
+        while True:
+            self.requests.acquire(1)
+            self.tokens.acquire(estimated)
+            self.concurrency.acquire()
+            try:
+                response = client.messages.create(**kwargs)
+            except (anthropic.APIStatusError, anthropic.APIConnectionError) as e:
+                status = getattr(e, "status_code", None)
+                throttled = status in THROTTLE_STATUS
+                self.concurrency.release(throttled=throttled)
+                # 请求没有被处理，退回预扣的 token
+                self.tokens.adjust(-estimated)
+                retryable = status is None or status in RETRYABLE_STATUS
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                wait = retry_after(e) if throttled else None
+                if wait is None:
+                    wait = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                attempt += 1
+                print(f"⏳ 模型接口{'返回 ' + str(status) if status else '连接失败'}，"
+                      f"{wait:.1f} 秒后第 {attempt} 次重试")
+                time.sleep(wait)
+                continue
+            except BaseException:
+                self.concurrency.release()
+                raise
+
+            self.concurrency.release()
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                self.tokens.adjust(usage.input_tokens + usage.output_tokens - estimated)
+            return response
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_client(client_factory) -> RateLimitedClient:
+    """进程内共享的限流客户端，首次调用时按环境变量创建"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = RateLimitedClient(
+                client_factory,
+                rpm=float(os.environ.get("ANTHROPIC_RPM", 50)),
+                tpm=float(os.environ.get("ANTHROPIC_TPM", 80000)),
+                max_retries=int(os.environ.get("ANTHROPIC_MAX_RETRIES", 6)),
+            )
+        return _shared_client
@@ -0,0 +1,192 @@
+"""
+接口测试 pytest 插件
+为生成的测试用例提供会话级共享 fixtures，避免每个用例重复建立连接、
+重复检查服务可用性、重复创建相同的测试数据
+
+使用方式：在 tests/conftest.py 中 from pytest_api_plugin import *
+环境变量：
+- API_SPEC       Swagger 文档路径，相对路径按 pytest rootdir 解析；run_pytest 会传入当前正在处理的
+                 文档的绝对路径。未设置时 swagger/ 下只有一个文档就用它，否则用 swagger/petstore.json
+- API_BASE_URL   覆盖文档 servers 中的地址
+- API_TIMEOUT    请求超时秒数，默认 10
+- API_HTTP_LOG   设置后把每个实际请求（方法、URL、状态码、所属用例）追加写入该 JSONL 文件，
+                 供 coverage_matrix 统计运行时覆盖
+"""
+import json
+import os
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from schema_validator import SchemaRegistry
+from spec_loader import default_spec_path, load_spec
+
+__all__ = [
+    "api_spec",
+    "base_url",
+    "api_session",
+    "server_available",
+    "require_server",
+    "api_resources",
+    "schema_registry",
+    "assert_matches_schema",
+    "_record_http_calls",
+]
+
+DEFAULT_TIMEOUT = 10
+
+
+def spec_base_url(spec: dict) -> str:
+    """从文档中取 base_url：OpenAPI 3 用 servers，Swagger 2 用 host + basePath"""
+    servers = spec.get("servers") or []
+    if servers:
+        return servers[0]["url"].rstrip("/")
+    if "host" in spec:
+        scheme = (spec.get("schemes") or ["https"])[0]
+        return f"{scheme}://{spec['host']}{spec.get('basePath', '')}".rstrip("/")
+    return ""
+
+
+class ApiSession(requests.Session):
+    """带连接池、默认超时和 base_url 的 Session，路径以 / 开头时自动拼接 base_url"""
+
+    def __init__(self, base_url: str, timeout: float = DEFAULT_TIMEOUT, pool_size: int = 10):
+        super().__init__()
+        self.base_url = base_url
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.headers.update({
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        })
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if url.startswith("/"):
+            url = self.base_url + url
+        return super().request(method, url, **kwargs)
+
+
+class ApiResources:
+    """会话内共享的测试数据：相同请求只创建一次，会话结束时统一清理"""
+
+    def __init__(self, session: ApiSession):
+        self._session = session
+        self._created = {}
+        self._cleanup = []
+
+    def ensure(self, path: str, payload: dict, cleanup_path: str = None) -> requests.Response:
+        """POST 创建资源并缓存响应；cleanup_path 会在会话结束时 DELETE"""
+        key = (path, json.dumps(payload, sort_keys=True))
+        if key not in self._created:
+            response = self._session.post(path, json=payload)
+            self._created[key] = response
+            if response.ok and cleanup_path:
+                self._cleanup.append(cleanup_path)
+        return self._created[key]
+
+    def cleanup(self):
+        for path in reversed(self._cleanup):
+            try:
+                self._session.delete(path)
+            except requests.RequestException:
+                pass
+        self._cleanup.clear()
+        self._created.clear()
+
+
+@pytest.fixture(scope="session")
+def api_spec(request):
+    """解析后的 Swagger 文档"""
+    root = str(request.config.rootpath)
+    path = os.environ.get("API_SPEC")
+    path = os.path.join(root, path) if path else default_spec_path(root)
+    try:
+        return load_spec(path)
+    except FileNotFoundError:
+        message = f"接口文档不存在：{path}，请通过环境变量 API_SPEC 指定"
+    except ValueError as e:
+        message = f"接口文档无法解析：{e}"
+    # 在 except 之外失败，报告里不再附带 FileNotFoundError 的异常链
+    pytest.fail(message, pytrace=False)
+
+
+@pytest.fixture(scope="session")
+def base_url(request):
+    """接口地址，优先取 API_BASE_URL（此时不读取文档），其次取文档 servers"""
+    url = os.environ.get("API_BASE_URL", "").rstrip("/")
+    return url or spec_base_url(request.getfixturevalue("api_spec"))
+
+
+@pytest.fixture(scope="session")
+def api_session(base_url):
+    """整个测试会话共用的 HTTP 客户端"""
+    session = ApiSession(base_url, timeout=float(os.environ.get("API_TIMEOUT", DEFAULT_TIMEOUT)))
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope="session")
+def server_available(api_session):
+    """服务是否可用，整个会话只检查一次"""
+    try:
+        return api_session.get(api_session.base_url).status_code < 500
+    except requests.RequestException:
+        return False
+
+
+@pytest.fixture
+def require_server(server_available):
+    """服务不可用时跳过当前用例"""
+    if not server_available:
+        pytest.skip("服务器当前不可用，跳过此测试")
+
+
+@pytest.fixture(scope="session")
+def api_resources(api_session):
+    """共享测试数据，会话结束自动清理"""
+    resources = ApiResources(api_session)
+    yield resources
+    resources.cleanup()
+
+
+@pytest.fixture(scope="session")
+def schema_registry(api_spec):
+    """按文档预编译的响应校验器，整个会话共用"""
+    return SchemaRegistry(api_spec)
+
+
+@pytest.fixture
+def assert_matches_schema(schema_registry):
+    """assert_matches_schema(operation, status, body)：校验响应体符合文档定义"""
+    return schema_registry.assert_matches
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _record_http_calls():
+    """设置 API_HTTP_LOG 时记录所有经由 requests 发出的请求"""
+    log_file = os.environ.get("API_HTTP_LOG")
+    if not log_file:
+        yield
+        return
+
+    original_send = requests.Session.send
+    log = open(log_file, 'a', encoding='utf-8')
+
+    def send(self, request, **kwargs):
+        response = original_send(self, request, **kwargs)
+        log.write(json.dumps({
+            "method": request.method,
+            "url": request.url,
+            "status": response.status_code,
+            "test": os.environ.get("PYTEST_CURRENT_TEST", "").split(" ")[0],
+        }, ensure_ascii=False) + "\n")
+        return response
+
+    requests.Session.send = send
+    yield
+    requests.Session.send = original_send
+    log.close()
@@ -0,0 +1,304 @@
+"""
+常驻 pytest 执行进程
+每次 run_pytest 都要冷启动一个 Python、导入 pytest / requests / 插件并重新收集，
+单次开销在 1 秒左右。这里启动一个常驻父进程预先导入这些依赖，每次运行时从父进程
+fork 出子进程执行 pytest.main：子进程互相隔离，又省去了解释器启动和依赖导入。
+测试模块在子进程中导入，pytest 的断言重写缓存（__pycache__）保证只有改动过的
+测试文件需要重新编译。
+
+- 通过 Unix socket 通信，请求为一行 JSON：{"args", "env", "cwd", "timeout"}
+- 响应为 pytest 的原始输出，末尾附带 TRAILER + "EXIT <退出码>" / "TIMEOUT" / "RESTART"
+- 父进程预加载的项目模块（如 pytest_api_plugin.py）被修改后，父进程退出并由客户端重启
+- 空闲超过 IDLE_TIMEOUT 秒自动退出
+- socket 和锁文件放在当前用户独占（0700）的目录中，socket 权限 0600，并用 SO_PEERCRED
+  校验连接方是同一用户：能连上来就能以本用户身份执行任意 pytest 参数
+
+仅支持提供 os.fork 的平台，其他平台由调用方退回普通子进程方式。
+手动启动：python pytest_daemon.py serve
+"""
+import hashlib
+import importlib
+import io
+import json
+import os
+import select
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+_ID = hashlib.blake2b(PROJECT_DIR.encode("utf-8"), digest_size=6).hexdigest()
+# Unix socket 路径长度有限制，放在临时目录下按用户区分的子目录中
+RUN_DIR = os.path.join(tempfile.gettempdir(),
+                       f"pytest-daemon-{os.getuid() if hasattr(os, 'getuid') else 0}")
+SOCKET_PATH = os.path.join(RUN_DIR, f"{_ID}.sock")
+LOCK_PATH = os.path.join(RUN_DIR, f"{_ID}.lock")
+
+IDLE_TIMEOUT = 1800
+START_TIMEOUT = 15
+TRAILER = b"\n\x00PYTEST_DAEMON "
+
+PRELOAD_MODULES = (
+    "pytest",
+    "_pytest.python",
+    "_pytest.terminal",
+    "_pytest.fixtures",
+    "_pytest.assertion.rewrite",
+    "requests",
+    "yaml",
+    "spec_loader",
+    "schema_validator",
+    "pytest_api_plugin",
+)
+
+
+def available() -> bool:
+    return hasattr(os, "fork") and hasattr(socket, "AF_UNIX")
+
+
+def _secure_run_dir():
+    """创建并校验 RUN_DIR：必须是当前用户所有、其他人无权限的目录，否则抛 RuntimeError"""
+    os.makedirs(RUN_DIR, mode=0o700, exist_ok=True)
+    info = os.lstat(RUN_DIR)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"pytest 常驻进程目录权限不安全 - {RUN_DIR}")
+
+
+def _same_user(conn) -> bool:
+    """连接方是否为同一用户；不支持 SO_PEERCRED 的平台依靠目录和 socket 的权限"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid == os.getuid()
+
+
+# ---------- 常驻进程 ----------
+
+class _Daemon:
+
+    def __init__(self):
+        self.server = None
+        self.children = {}   # pid -> (连接, 截止时间)
+        self.preloaded = {}  # 预加载的项目内模块文件 -> mtime
+
+    def preload(self):
+        sys.path.insert(0, PROJECT_DIR)
+        for name in PRELOAD_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+        self.warm_up()
+        for module in list(sys.modules.values()):
+            path = getattr(module, "__file__", None)
+            if path and os.path.abspath(path).startswith(PROJECT_DIR + os.sep):
+                self.preloaded[path] = os.path.getmtime(path)
+
+    @staticmethod
+    def warm_up():
+        """在空目录上跑一次 pytest.main：首次运行要加载全部内置插件和第三方插件，
+        放在父进程里做一次，fork 出的子进程就不再重复"""
+        import contextlib
+        import pytest
+        with tempfile.TemporaryDirectory() as empty, open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                try:
+                    pytest.main(["-q", "-p", "no:cacheprovider", empty])
+                except Exception:
+                    pass
+
+    def stale(self) -> bool:
+        for path, mtime in self.preloaded.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def serve(self):
+        _secure_run_dir()
+        self.preload()
+        if os.path.exists(SOCKET_PATH):
+            os.unlink(SOCKET_PATH)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(SOCKET_PATH)
+        os.chmod(SOCKET_PATH, 0o600)
+        self.server.listen(16)
+
+        last_activity = time.monotonic()
+        while True:
+            if self.server is not None:
+                # 有子进程在跑时缩短轮询间隔，尽快把结果交还客户端
+                wait = 0.01 if self.children else 0.5
+                readable, _, _ = select.select([self.server], [], [], wait)
+                if readable:
+                    conn, _ = self.server.accept()
+                    last_activity = time.monotonic()
+                    self.handle(conn)
+            else:
+                time.sleep(0.01)
+            self.reap()
+
+            idle = time.monotonic() - last_activity > IDLE_TIMEOUT
+            if idle and self.server is not None:
+                self.stop_listening()
+            if self.server is None and not self.children:
+                return
+
+    def stop_listening(self):
+        self.server.close()
+        self.server = None
+        try:
+            os.unlink(SOCKET_PATH)
+        except OSError:
+            pass
+
+    def handle(self, conn):
+        if not _same_user(conn):
+            conn.close()
+            return
+        try:
+            request = json.loads(conn.makefile("rb").readline())
+        except (OSError, ValueError):
+            conn.close()
+            return
+        if self.stale():
+            # 预加载的模块已过期：让客户端重启常驻进程
+            self.stop_listening()
+            conn.sendall(TRAILER + b"RESTART\n")
+            conn.close()
+            return
+
+        pid = os.fork()
+        if pid == 0:
+            code = 3
+            try:
+                self.server.close()
+                code = _run_child(conn, request)
+            finally:
+                os._exit(code)
+        self.children[pid] = (conn, time.monotonic() + request.get("timeout", 60))
+
+    def reap(self):
+        for pid, (conn, deadline) in list(self.children.items()):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                trailer = f"EXIT {os.waitstatus_to_exitcode(status)}"
+            elif time.monotonic() > deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                trailer = "TIMEOUT"
+            else:
+                continue
+            try:
+                conn.sendall(TRAILER + trailer.encode() + b"\n")
+            except OSError:
+                pass
+            conn.close()
+            del self.children[pid]
+
+
+def _run_child(conn, request) -> int:
+    """fork 出的子进程：切换环境，把输出直接写回客户端连接，执行 pytest"""
+    import pytest
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    os.dup2(conn.fileno(), 1)
+    os.dup2(conn.fileno(), 2)
+    sys.stdout = io.TextIOWrapper(os.fdopen(1, "wb", closefd=False), encoding="utf-8",
+                                  errors="replace", line_buffering=True)
+    sys.stderr = sys.stdout
+    try:
+        code = int(pytest.main(request["args"]))
+    finally:
+        sys.stdout.flush()
+    return code
+
+
+# ---------- 客户端 ----------
+
+def _connect():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_PATH)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def _start_daemon():
+    """启动常驻进程并等待 socket 就绪；用文件锁避免并发重复启动"""
+    import fcntl
+    _secure_run_dir()
+    with open(LOCK_PATH, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        sock = _connect()
+        if sock is not None:
+            return sock
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve"],
+            cwd=PROJECT_DIR, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            sock = _connect()
+            if sock is not None:
+                return sock
+            time.sleep(0.05)
+    raise RuntimeError("pytest 常驻进程启动超时")
+
+
+def run(args: list, env: dict = None, cwd: str = PROJECT_DIR, timeout: float = 60) -> tuple:
+    """在常驻进程中执行 pytest，返回 (退出码, 输出)；超时抛 subprocess.TimeoutExpired"""
+    request = json.dumps({
+        "args": list(args),
+        "env": dict(env if env is not None else os.environ),
+        "cwd": cwd,
+        "timeout": timeout,
+    }).encode("utf-8") + b"\n"
+
+    # 连接前校验目录：请求中带有完整的环境变量（含 API Key），不能发给别人创建的 socket
+    _secure_run_dir()
+    for _ in range(2):
+        sock = _connect() or _start_daemon()
+        with sock:
+            sock.sendall(request)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        data = b"".join(chunks)
+
+        index = data.rfind(TRAILER)
+        if index < 0:
+            raise RuntimeError("pytest 常驻进程异常断开")
+        status = data[index + len(TRAILER):].decode().strip()
+        output = data[:index].decode("utf-8", errors="replace")
+        if status == "RESTART":
+            continue
+        if status == "TIMEOUT":
+            raise subprocess.TimeoutExpired(args, timeout, output=output)
+        return int(status.split()[1]), output
+    raise RuntimeError("pytest 常驻进程重启失败")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        _Daemon().serve()
+    else:
+        print(__doc__)
@@ -0,0 +1,239 @@
+"""
+测试执行历史
+每次 run_pytest 的结果写入本地 SQLite（HISTORY_DB）：每个用例的结果和耗时，以及当次的
+文档、测试文件哈希。基于历史数据：
+- trends：各用例的耗时中位数、最近一次耗时、通过率和耗时走势
+- estimates：每个用例的预估耗时，分布式执行时按耗时从长到短派发，让各 worker 同时结束
+- regressions：本次耗时比历史中位数慢超过阈值的用例
+
+表结构：
+    runs(id, started_at, elapsed, target, workers, spec_hash, tests_hash, passed, failed, skipped)
+    results(run_id, nodeid, outcome, duration, file_hash)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import time
+from contextlib import contextmanager
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_DB = os.path.join(PROJECT_DIR, ".agent_cache", "history.sqlite3")
+
+BASELINE_RUNS = 5               # 预估耗时 / 回归判断取最近几次通过的耗时
+RECENT_RUNS = 50                # 查询只看最近这么多次执行，开销不随历史增长
+REGRESSION_THRESHOLD = 0.5      # 比基线慢 50% 以上视为回归
+REGRESSION_MIN_SECONDS = 0.05   # 且至少慢这么多秒，忽略毫秒级抖动
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    elapsed REAL NOT NULL,
+    target TEXT,
+    workers INTEGER NOT NULL DEFAULT 0,
+    spec_hash TEXT,
+    tests_hash TEXT,
+    passed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    nodeid TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    duration REAL NOT NULL,
+    file_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_nodeid ON results(nodeid, run_id);
+CREATE INDEX IF NOT EXISTS idx_results_run ON results(run_id);
+"""
+
+
+def file_hash(path: str) -> str:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    except OSError:
+        return None
+
+
+def read_report(report_file: str) -> dict:
+    """读取 distributed_runner 插件写出的逐条结果，返回 {节点 ID: {"outcome", "duration"}}"""
+    results = {}
+    try:
+        with open(report_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    results[result["nodeid"]] = result
+    except (OSError, json.JSONDecodeError):
+        pass
+    return results
+
+
+class RunHistory:
+
+    def __init__(self, path: str = HISTORY_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """连接在退出时提交并关闭"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            # WAL：服务模式下多个任务同时写入时读不被阻塞
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_run(self, results: dict, root: str, target: str, elapsed: float,
+                   workers: int = 0, spec_path: str = None) -> int:
+        """写入一次执行，返回 run_id"""
+        file_hashes = {}
+        for nodeid in results:
+            test_file = nodeid.split("::", 1)[0]
+            if test_file not in file_hashes:
+                file_hashes[test_file] = file_hash(os.path.join(root, test_file))
+        tests_hash = hashlib.blake2b(
+            json.dumps(sorted(file_hashes.items())).encode("utf-8"), digest_size=8).hexdigest()
+        outcomes = [result["outcome"] for result in results.values()]
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (started_at, elapsed, target, workers, spec_hash, tests_hash,"
+                " passed, failed, skipped) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time() - elapsed, elapsed, target, workers,
+                 file_hash(os.path.join(root, spec_path)) if spec_path else None, tests_hash,
+                 outcomes.count("passed"), outcomes.count("failed") + outcomes.count("error"),
+                 outcomes.count("skipped"))
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO results (run_id, nodeid, outcome, duration, file_hash)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(run_id, nodeid, result["outcome"], result["duration"],
+                  file_hashes[nodeid.split("::", 1)[0]]) for nodeid, result in results.items()]
+            )
+        return run_id
+
+    @staticmethod
+    def _latest(conn, columns: str, where: str, params: tuple, per_test: int,
+                before_run: int = None) -> list:
+        """最近 RECENT_RUNS 次执行（before_run 之前）中每个用例最新的 per_test 条记录，
+        按 (节点 ID, 新旧) 排序"""
+        before_run = before_run if before_run is not None else 2 ** 62
+        (first_run,) = conn.execute(
+            "SELECT COALESCE(MIN(id), 0) FROM"
+            " (SELECT id FROM runs WHERE id < ? ORDER BY id DESC LIMIT ?)",
+            (before_run, RECENT_RUNS)).fetchone()
+        return conn.execute(
+            f"SELECT {columns} FROM (SELECT *, ROW_NUMBER() OVER"
+            f" (PARTITION BY nodeid ORDER BY run_id DESC) AS recency FROM results"
+            f" WHERE run_id >= ? AND run_id < ?{where})"
+            f" WHERE recency <= ? ORDER BY nodeid, recency",
+            (first_run, before_run, *params, per_test)).fetchall()
+
+    def _passed_durations(self, conn, before_run: int = None) -> dict:
+        """{节点 ID: [最近 BASELINE_RUNS 次通过的耗时]}，新的在前"""
+        durations = {}
+        for nodeid, duration in self._latest(conn, "nodeid, duration", " AND outcome = 'passed'",
+                                             (), BASELINE_RUNS, before_run):
+            durations.setdefault(nodeid, []).append(duration)
+        return durations
+
+    def estimates(self) -> dict:
+        """每个用例的预估耗时（最近几次通过耗时的中位数）"""
+        with self._connect() as conn:
+            return {nodeid: statistics.median(samples)
+                    for nodeid, samples in self._passed_durations(conn).items()}
+
+    def regressions(self, run_id: int, threshold: float = REGRESSION_THRESHOLD,
+                    min_seconds: float = REGRESSION_MIN_SECONDS) -> list:
+        """本次通过但耗时比之前的中位数慢超过阈值的用例，按变慢幅度排序"""
+        with self._connect() as conn:
+            baseline = self._passed_durations(conn, before_run=run_id)
+            previous_hash = dict(self._latest(conn, "nodeid, file_hash", "", (), 1, run_id))
+            current = conn.execute(
+                "SELECT nodeid, duration, file_hash FROM results"
+                " WHERE run_id = ? AND outcome = 'passed'", (run_id,)).fetchall()
+
+        found = []
+        for nodeid, duration, current_hash in current:
+            samples = baseline.get(nodeid)
+            if not samples:
+                continue
+            median = statistics.median(samples)
+            if duration - median >= min_seconds and duration > median * (1 + threshold):
+                found.append({
+                    "nodeid": nodeid,
+                    "baseline": median,
+                    "duration": duration,
+                    "changed": previous_hash.get(nodeid) not in (None, current_hash),
+                })
+        return sorted(found, key=lambda r: r["duration"] / max(r["baseline"], 1e-6), reverse=True)
+
+    def trends(self, pattern: str = None, limit: int = 20, window: int = 10) -> list:
+        """各用例最近 window 次执行的耗时统计，按中位数从大到小"""
+        where, params = (" AND nodeid LIKE ?", (f"%{pattern}%",)) if pattern else ("", ())
+        with self._connect() as conn:
+            rows = self._latest(conn, "nodeid, outcome, duration", where, params, window)
+
+        recent = {}
+        for nodeid, outcome, duration in rows:
+            recent.setdefault(nodeid, []).append((outcome, duration))
+        trends = []
+        for nodeid, samples in recent.items():
+            durations = [duration for _, duration in samples]
+            older, newer = durations[len(durations) // 2:], durations[:len(durations) // 2]
+            # 毫秒级的用例耗时抖动大，不计算走势
+            change = (statistics.mean(newer) / statistics.mean(older) - 1
+                      if newer and statistics.mean(older) >= REGRESSION_MIN_SECONDS else 0.0)
+            trends.append({
+                "nodeid": nodeid,
+                "runs": len(samples),
+                "pass_rate": sum(1 for outcome, _ in samples if outcome == "passed") / len(samples),
+                "median": statistics.median(durations),
+                "last": durations[0],
+                "change": change,
+            })
+        trends.sort(key=lambda t: t["median"], reverse=True)
+        return trends[:limit]
+
+    def run_count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+
+def format_regressions(regressions: list, threshold: float = REGRESSION_THRESHOLD) -> str:
+    if not regressions:
+        return ""
+    lines = [f"\n=== 耗时回归（比历史中位数慢 {threshold:.0%} 以上）==="]
+    for item in regressions:
+        note = "（测试文件已修改）" if item["changed"] else ""
+        lines.append(f"  {item['nodeid']}：{item['baseline']:.2f}s → {item['duration']:.2f}s"
+                     f"（{item['duration'] / max(item['baseline'], 1e-6) - 1:+.0%}）{note}")
+    return "\n".join(lines)
+
+
+def format_trends(trends: list, total_runs: int) -> str:
+    if not trends:
+        return "暂无执行历史，先运行 run_pytest"
+    lines = [f"共 {total_runs} 次执行；最近 10 次：中位耗时 / 最近一次 / 通过率 / 走势（近半段对比前半段）"]
+    for t in trends:
+        lines.append(f"  {t['nodeid']}：{t['median']:.2f}s / {t['last']:.2f}s / "
+                     f"{t['pass_rate']:.0%} / {t['change']:+.0%}（{t['runs']} 次）")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import sys
+    history = RunHistory()
+    print(format_trends(history.trends(sys.argv[1] if len(sys.argv) > 1 else None),
+                        history.run_count()))
@@ -0,0 +1,302 @@
+"""
+响应契约校验
+把 Swagger 文档中的 schema（含 $ref）预编译成校验函数并缓存，
+每个 schema 只解释一次，之后每次校验只是调用闭包
+
+用法：
+    registry = SchemaRegistry(spec)
+    registry.assert_matches("getPetById", 200, response.json())
+"""
+import re
+
+_INT_RANGES = {
+    "int32": (-2**31, 2**31 - 1),
+    "int64": (-2**63, 2**63 - 1),
+}
+
+_TYPE_CHECKS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "boolean": lambda v: isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+_HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+
+
+class SchemaValidationError(AssertionError):
+    """响应不符合文档定义"""
+
+    def __init__(self, errors: list):
+        self.errors = errors
+        super().__init__("响应不符合 schema：\n" + "\n".join(errors))
+
+
+def _noop(value, path, errors):
+    pass
+
+
+class SchemaRegistry:
+    """文档级 schema 编译缓存"""
+
+    def __init__(self, spec: dict):
+        self.spec = spec
+        self._refs = {}          # $ref -> 编译后的校验函数
+        self._responses = {}     # (operation, status) -> 校验函数
+        self._operations = self._index_operations(spec)
+
+    # ---------- 编译 ----------
+
+    def compile(self, schema: dict):
+        """把 schema 编译成 fn(value, path, errors)"""
+        if not schema:
+            return _noop
+        if "$ref" in schema:
+            return self._compile_ref(schema["$ref"])
+
+        checks = []
+        nullable = schema.get("nullable", False)
+
+        schema_type = schema.get("type")
+        if schema_type:
+            types = schema_type if isinstance(schema_type, list) else [schema_type]
+            type_checks = [_TYPE_CHECKS[t] for t in types if t in _TYPE_CHECKS]
+            expected = "/".join(types)
+
+            def check_type(value, path, errors):
+                if not any(check(value) for check in type_checks):
+                    errors.append(f"{path}: 期望 {expected}，实际为 {type(value).__name__}")
+                    return False
+                return True
+        else:
+            check_type = None
+
+        if "enum" in schema:
+            allowed = schema["enum"]
+
+            def check_enum(value, path, errors):
+                if value not in allowed:
+                    errors.append(f"{path}: {value!r} 不在枚举 {allowed} 中")
+            checks.append(check_enum)
+
+        checks.extend(self._compile_number(schema))
+        checks.extend(self._compile_string(schema))
+        checks.extend(self._compile_object(schema))
+        checks.extend(self._compile_array(schema))
+        checks.extend(self._compile_combinators(schema))
+
+        def validate(value, path, errors):
+            if value is None and nullable:
+                return
+            if check_type is not None and not check_type(value, path, errors):
+                return
+            for check in checks:
+                check(value, path, errors)
+        return validate
+
+    def _compile_ref(self, ref: str):
+        if ref not in self._refs:
+            # 先放占位函数，支持递归引用（如 Category.children: [Category]）
+            slot = []
+            self._refs[ref] = lambda value, path, errors: slot[0](value, path, errors)
+            slot.append(self.compile(self._resolve(ref)))
+            self._refs[ref] = slot[0]
+        return self._refs[ref]
+
+    def _resolve(self, ref: str) -> dict:
+        if not ref.startswith("#/"):
+            raise ValueError(f"不支持外部引用: {ref}")
+        node = self.spec
+        for part in ref[2:].split("/"):
+            node = node[part.replace("~1", "/").replace("~0", "~")]
+        return node
+
+    def _compile_number(self, schema: dict) -> list:
+        checks = []
+        low, high = _INT_RANGES.get(schema.get("format"), (None, None))
+        if "minimum" in schema:
+            low = schema["minimum"] if low is None else max(low, schema["minimum"])
+        if "maximum" in schema:
+            high = schema["maximum"] if high is None else min(high, schema["maximum"])
+        exclusive_min = schema.get("exclusiveMinimum") is True
+        exclusive_max = schema.get("exclusiveMaximum") is True
+
+        if low is not None or high is not None:
+            def check_range(value, path, errors):
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    return
+                if low is not None and (value < low or (exclusive_min and value == low)):
+                    errors.append(f"{path}: {value} 小于下限 {low}")
+                if high is not None and (value > high or (exclusive_max and value == high)):
+                    errors.append(f"{path}: {value} 超过上限 {high}")
+            checks.append(check_range)
+        return checks
+
+    def _compile_string(self, schema: dict) -> list:
+        checks = []
+        min_length, max_length = schema.get("minLength"), schema.get("maxLength")
+        if min_length is not None or max_length is not None:
+            def check_length(value, path, errors):
+                if not isinstance(value, str):
+                    return
+                if min_length is not None and len(value) < min_length:
+                    errors.append(f"{path}: 长度 {len(value)} 小于 minLength {min_length}")
+                if max_length is not None and len(value) > max_length:
+                    errors.append(f"{path}: 长度 {len(value)} 超过 maxLength {max_length}")
+            checks.append(check_length)
+
+        if "pattern" in schema:
+            pattern = re.compile(schema["pattern"])
+
+            def check_pattern(value, path, errors):
+                if isinstance(value, str) and not pattern.search(value):
+                    errors.append(f"{path}: {value!r} 不匹配 {pattern.pattern}")
+            checks.append(check_pattern)
+        return checks
+
+    def _compile_object(self, schema: dict) -> list:
+        checks = []
+        required = tuple(schema.get("required", ()))
+        properties = {
+            name: self.compile(sub) for name, sub in schema.get("properties", {}).items()
+        }
+        extra = schema.get("additionalProperties", True)
+        extra_validator = self.compile(extra) if isinstance(extra, dict) else None
+
+        if required:
+            def check_required(value, path, errors):
+                if isinstance(value, dict):
+                    for name in required:
+                        if name not in value:
+                            errors.append(f"{path}: 缺少必填字段 {name}")
+            checks.append(check_required)
+
+        if properties or extra is False or extra_validator:
+            def check_properties(value, path, errors):
+                if not isinstance(value, dict):
+                    return
+                for name, item in value.items():
+                    validator = properties.get(name)
+                    if validator is not None:
+                        validator(item, f"{path}.{name}", errors)
+                    elif extra is False:
+                        errors.append(f"{path}: 不允许的字段 {name}")
+                    elif extra_validator is not None:
+                        extra_validator(item, f"{path}.{name}", errors)
+            checks.append(check_properties)
+        return checks
+
+    def _compile_array(self, schema: dict) -> list:
+        checks = []
+        if "items" in schema:
+            item_validator = self.compile(schema["items"])
+
+            def check_items(value, path, errors):
+                if isinstance(value, list):
+                    for i, item in enumerate(value):
+                        item_validator(item, f"{path}[{i}]", errors)
+            checks.append(check_items)
+
+        min_items, max_items = schema.get("minItems"), schema.get("maxItems")
+        if min_items is not None or max_items is not None:
+            def check_size(value, path, errors):
+                if not isinstance(value, list):
+                    return
+                if min_items is not None and len(value) < min_items:
+                    errors.append(f"{path}: 元素数 {len(value)} 少于 minItems {min_items}")
+                if max_items is not None and len(value) > max_items:
+                    errors.append(f"{path}: 元素数 {len(value)} 超过 maxItems {max_items}")
+            checks.append(check_size)
+        return checks
+
+    def _compile_combinators(self, schema: dict) -> list:
+        checks = []
+        for sub in schema.get("allOf", ()):
+            checks.append(self.compile(sub))
+
+        for keyword in ("anyOf", "oneOf"):
+            if keyword not in schema:
+                continue
+            options = [self.compile(sub) for sub in schema[keyword]]
+            exactly_one = keyword == "oneOf"
+
+            def check_options(value, path, errors, options=options, exactly_one=exactly_one,
+                              keyword=keyword):
+                matched = 0
+                for option in options:
+                    option_errors = []
+                    option(value, path, option_errors)
+                    matched += not option_errors
+                if matched == 0 or (exactly_one and matched > 1):
+                    errors.append(f"{path}: 匹配了 {matched} 个 {keyword} 分支")
+            checks.append(check_options)
+        return checks
+
+    # ---------- 接口响应 ----------
+
+    @staticmethod
+    def _index_operations(spec: dict) -> dict:
+        """operationId 和 "GET /path" 两种写法都能找到接口定义"""
+        operations = {}
+        for path, item in spec.get("paths", {}).items():
+            for method in _HTTP_METHODS:
+                operation = item.get(method)
+                if operation is None:
+                    continue
+                operations[f"{method.upper()} {path}"] = operation
+                if "operationId" in operation:
+                    operations[operation["operationId"]] = operation
+        return operations
+
+    def response_validator(self, operation: str, status):
+        """取某接口某状态码的响应校验函数，结果会缓存"""
+        key = (operation, str(status))
+        if key not in self._responses:
+            op = self._operations.get(operation)
+            if op is None:
+                raise KeyError(f"文档中没有接口 {operation}")
+            responses = op.get("responses", {})
+            status = str(status)
+            response = (responses.get(status)
+                        or responses.get(f"{status[0]}XX")
+                        or responses.get("default"))
+            if response is None:
+                raise KeyError(f"接口 {operation} 未定义状态码 {status} 的响应")
+            if "$ref" in response:
+                response = self._resolve(response["$ref"])
+            self._responses[key] = self.compile(self._response_schema(response))
+        return self._responses[key]
+
+    @staticmethod
+    def _response_schema(response: dict) -> dict:
+        # OpenAPI 3: content.<media>.schema；Swagger 2: schema
+        if "schema" in response:
+            return response["schema"]
+        content = response.get("content", {})
+        media = content.get("application/json") or next(iter(content.values()), {})
+        return media.get("schema", {})
+
+    def validate(self, operation: str, status, body) -> list:
+        """返回错误列表，空列表表示通过"""
+        errors = []
+        self.response_validator(operation, status)(body, "$", errors)
+        return errors
+
+    def assert_matches(self, operation: str, status, body):
+        """断言响应体符合文档；body 可以是解析后的 JSON 或 requests.Response。
+        文档没有定义该状态码时同样断言失败，文档中没有该接口时抛 KeyError"""
+        try:
+            validator = self.response_validator(operation, status)
+        except KeyError:
+            if operation not in self._operations:
+                raise
+            raise SchemaValidationError([f"$: 接口 {operation} 未定义状态码 {status}"]) from None
+        if hasattr(body, "json") and callable(body.json):
+            body = body.json()
+        errors = []
+        validator(body, "$", errors)
+        if errors:
+            raise SchemaValidationError(errors)
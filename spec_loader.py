@@ -0,0 +1,129 @@
+"""
+Swagger 文档解析缓存
+- YAML 优先使用 C 加速的 CSafeLoader
+- 内存 LRU：按 (路径, mtime, 大小) 命中，文件未变化时不再读盘
+- 磁盘缓存：按文件内容哈希保存 pickle，跨会话复用解析结果；超过 DISK_CACHE_SIZE 个时
+  删除最久未使用的
+- 工具线程和服务模式的多个任务会并发调用，内存缓存由锁保护
+
+返回的文档对象会被多处共享，调用方不要修改它
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(PROJECT_DIR, ".agent_cache", "specs")
+MEMORY_CACHE_SIZE = 16
+DISK_CACHE_SIZE = 64
+DEFAULT_SPEC = os.path.join("swagger", "petstore.json")
+
+_memory_cache = OrderedDict()  # (full_path, mtime_ns, size) -> 文档
+_memory_lock = threading.Lock()
+_MISSING = object()
+
+
+def _yaml_load(content: bytes):
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(content, Loader=loader)
+
+
+def _parse(full_path: str, content: bytes):
+    if full_path.endswith(('.yaml', '.yml')):
+        return _yaml_load(content)
+    return json.loads(content)
+
+
+def _read_disk_cache(cache_path: str):
+    try:
+        with open(cache_path, 'rb') as f:
+            data = pickle.load(f)
+        os.utime(cache_path)  # 更新 mtime，清理时按最近使用时间保留
+        return data
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def _prune_disk_cache():
+    """磁盘缓存超过 DISK_CACHE_SIZE 个时删除最久未使用的"""
+    try:
+        entries = []
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".pickle"):
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+        entries.sort(reverse=True)
+        for _, path in entries[DISK_CACHE_SIZE:]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_disk_cache(cache_path: str, data):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except (OSError, pickle.PicklingError):
+        return  # 缓存写入失败不影响正常解析
+    _prune_disk_cache()
+
+
+def default_spec_path(root: str) -> str:
+    """root/swagger 下只有一个文档时返回它，否则返回 swagger/petstore.json（均为绝对路径）"""
+    swagger_dir = os.path.join(root, "swagger")
+    try:
+        specs = [name for name in os.listdir(swagger_dir)
+                 if name.endswith(('.json', '.yaml', '.yml'))]
+    except OSError:
+        specs = []
+    if len(specs) == 1:
+        return os.path.join(swagger_dir, specs[0])
+    return os.path.join(root, DEFAULT_SPEC)
+
+
+def load_spec(file_path: str):
+    """解析 JSON/YAML 文档，file_path 相对项目根目录；其他格式抛 ValueError"""
+    full_path = os.path.join(PROJECT_DIR, file_path)
+    if not full_path.endswith(('.json', '.yaml', '.yml')):
+        raise ValueError(f"不支持的文档格式: {file_path}")
+
+    stat = os.stat(full_path)
+    key = (full_path, stat.st_mtime_ns, stat.st_size)
+    with _memory_lock:
+        data = _memory_cache.get(key, _MISSING)
+        if data is not _MISSING:
+            _memory_cache.move_to_end(key)
+            return data
+
+    with open(full_path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, f"{digest}.pickle")
+
+    data = _read_disk_cache(cache_path)
+    if data is None:
+        data = _parse(full_path, content)
+        _write_disk_cache(cache_path, data)
+
+    with _memory_lock:
+        _memory_cache[key] = data
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return data
+
+
+def clear_cache():
+    """清空内存缓存（磁盘缓存按内容哈希命名，无需清理）"""
+    _memory_cache.clear()
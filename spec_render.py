@@ -0,0 +1,211 @@
+"""
+Swagger 文档的紧凑渲染
+json.dumps(indent=2) 会带来大量空白，且被引用的 schema 每次都展开一遍。
+这里把文档渲染成稠密、稳定的文本：
+- 共享 schema 只在 schemas 段输出一次，其他地方只写名字
+- 响应定义相同的状态码合并成一行
+- 按详细程度省略或截断 description / example
+
+详细程度：
+- full     保留描述和示例
+- normal   描述截断，去掉示例
+- minimal  只保留结构
+"""
+import json
+
+VERBOSITY_LEVELS = ("full", "normal", "minimal")
+SHORT_DESCRIPTION = 40
+
+_HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+_SCALAR_NAMES = {"integer": "int", "number": "num", "string": "str", "boolean": "bool"}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 字符一个 token，中日韩字符约 1 字一个"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+class _Renderer:
+
+    def __init__(self, spec: dict, verbosity: str):
+        if verbosity not in VERBOSITY_LEVELS:
+            raise ValueError(f"verbosity 必须是 {VERBOSITY_LEVELS} 之一")
+        self.spec = spec
+        self.verbosity = verbosity
+
+    def resolve(self, node: dict) -> dict:
+        while isinstance(node, dict) and "$ref" in node:
+            target = self.spec
+            for part in node["$ref"][2:].split("/"):
+                target = target[part.replace("~1", "/").replace("~0", "~")]
+            node = target
+        return node
+
+    def describe(self, text) -> str:
+        if not text or self.verbosity == "minimal":
+            return ""
+        text = " ".join(str(text).split())
+        if self.verbosity == "normal" and len(text) > SHORT_DESCRIPTION:
+            text = text[:SHORT_DESCRIPTION] + "…"
+        return f' "{text}"'
+
+    def example(self, schema: dict) -> str:
+        if self.verbosity != "full" or "example" not in schema:
+            return ""
+        return " eg=" + json.dumps(schema["example"], ensure_ascii=False, separators=(",", ":"))
+
+    def type_expr(self, schema: dict) -> str:
+        if not schema:
+            return "any"
+        if "$ref" in schema:
+            return schema["$ref"].rsplit("/", 1)[-1]
+
+        for keyword, joiner in (("allOf", "&"), ("oneOf", "|"), ("anyOf", "|")):
+            if keyword in schema:
+                expr = "(" + joiner.join(self.type_expr(s) for s in schema[keyword]) + ")"
+                break
+        else:
+            expr = self._plain_type_expr(schema)
+
+        if schema.get("nullable"):
+            expr += "?"
+        return expr
+
+    def _plain_type_expr(self, schema: dict) -> str:
+        schema_type = schema.get("type")
+        if "enum" in schema:
+            return "enum(" + "|".join(str(v) for v in schema["enum"]) + ")"
+        if schema_type == "array":
+            expr = f"[{self.type_expr(schema.get('items', {}))}]"
+            return expr + self._bounds(schema, "minItems", "maxItems")
+        if schema_type == "object" or "properties" in schema:
+            return self.object_expr(schema)
+
+        expr = schema.get("format") or _SCALAR_NAMES.get(schema_type, schema_type or "any")
+        expr += self._bounds(schema, "minimum", "maximum")
+        expr += self._bounds(schema, "minLength", "maxLength")
+        if "pattern" in schema:
+            expr += f"/{schema['pattern']}/"
+        return expr
+
+    @staticmethod
+    def _bounds(schema: dict, low_key: str, high_key: str) -> str:
+        low, high = schema.get(low_key), schema.get(high_key)
+        if low is None and high is None:
+            return ""
+        return f"[{'' if low is None else low}..{'' if high is None else high}]"
+
+    def object_expr(self, schema: dict) -> str:
+        required = set(schema.get("required", ()))
+        fields = []
+        for name, prop in schema.get("properties", {}).items():
+            star = "*" if name in required else ""
+            fields.append(f"{name}{star}:{self.type_expr(prop)}"
+                          f"{self.describe(prop.get('description'))}{self.example(prop)}")
+        extra = schema.get("additionalProperties")
+        if isinstance(extra, dict):
+            fields.append(f"...:{self.type_expr(extra)}")
+        return "{" + ", ".join(fields) + "}"
+
+    # ---------- 各段落 ----------
+
+    def header(self) -> list:
+        info = self.spec.get("info", {})
+        lines = [f"# {info.get('title', '')} {info.get('version', '')}".rstrip()
+                 + self.describe(info.get("description"))]
+        servers = [s["url"] for s in self.spec.get("servers", [])]
+        if not servers and "host" in self.spec:
+            scheme = (self.spec.get("schemes") or ["https"])[0]
+            servers = [f"{scheme}://{self.spec['host']}{self.spec.get('basePath', '')}"]
+        if servers:
+            lines.append("servers: " + " ".join(servers))
+        return lines
+
+    def schemas(self) -> list:
+        schemas = (self.spec.get("components", {}).get("schemas")
+                   or self.spec.get("definitions") or {})
+        if not schemas:
+            return []
+        lines = ["## schemas"]
+        for name in sorted(schemas):
+            schema = schemas[name]
+            lines.append(f"{name}{self.describe(schema.get('description'))} = "
+                         f"{self.type_expr(schema)}{self.example(schema)}")
+        return lines
+
+    def operations(self) -> list:
+        lines = ["## operations"]
+        for path in sorted(self.spec.get("paths", {})):
+            item = self.spec["paths"][path]
+            shared_params = item.get("parameters", [])
+            for method in _HTTP_METHODS:
+                if method in item:
+                    lines.extend(self.operation(method, path, item[method], shared_params))
+        return lines
+
+    def operation(self, method: str, path: str, op: dict, shared_params: list) -> list:
+        title = op.get("summary") or op.get("description")
+        head = f"{method.upper()} {path}"
+        if op.get("operationId"):
+            head += f" {op['operationId']}"
+        if op.get("deprecated"):
+            head += " [deprecated]"
+        lines = [head + self.describe(title)]
+
+        params, body = [], None
+        for param in shared_params + op.get("parameters", []):
+            param = self.resolve(param)
+            if param.get("in") == "body":  # Swagger 2
+                body = (param.get("schema", {}), param.get("required", False))
+                continue
+            star = "*" if param.get("required") else ""
+            schema = param.get("schema", param)
+            params.append(f"{param['name']}{star}@{param.get('in')}:{self.type_expr(schema)}")
+        if params:
+            lines.append("  in: " + ", ".join(params))
+
+        if "requestBody" in op:
+            request_body = self.resolve(op["requestBody"])
+            body = (self._content_schema(request_body), request_body.get("required", False))
+        if body is not None:
+            lines.append(f"  body{'*' if body[1] else ''}: {self.type_expr(body[0])}")
+
+        # 响应定义完全相同的状态码合并为一行
+        grouped = {}
+        for status, response in op.get("responses", {}).items():
+            response = self.resolve(response)
+            schema = self._content_schema(response)
+            rendered = (self.type_expr(schema) if schema else "-") \
+                + self.describe(response.get("description"))
+            grouped.setdefault(rendered, []).append(str(status))
+        for rendered, statuses in grouped.items():
+            lines.append(f"  {','.join(statuses)}: {rendered}")
+        return lines
+
+    @staticmethod
+    def _content_schema(node: dict) -> dict:
+        if "schema" in node:
+            return node["schema"]
+        content = node.get("content", {})
+        media = content.get("application/json") or next(iter(content.values()), {})
+        return media.get("schema", {})
+
+    def render(self) -> str:
+        return "\n".join(self.header() + self.schemas() + self.operations())
+
+
+def render_compact(spec: dict, verbosity: str = "normal") -> str:
+    """按指定详细程度渲染文档"""
+    return _Renderer(spec, verbosity).render()
+
+
+def render_within_budget(spec: dict, max_tokens: int):
+    """选择不超过 token 预算的最详细渲染，返回 (文本, 详细程度, 估算 token 数)。
+    即使 minimal 也超出预算，仍返回 minimal 结果，由调用方决定如何处理"""
+    for verbosity in VERBOSITY_LEVELS:
+        text = render_compact(spec, verbosity)
+        tokens = estimate_tokens(text)
+        if tokens <= max_tokens:
+            break
+    return text, verbosity, tokens
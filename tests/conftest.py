@@ -1,9 +1,10 @@
 """
 pytest 配置文件
 """
-import pytest
-
-# 可以在这里添加 fixtures，如：
-# - 认证 token
-# - 测试数据清理
-# - 环境配置
+# 会话级共享 fixtures，见 pytest_api_plugin.py：
+# - api_spec / base_url：Swagger 文档及其 servers 地址
+# - api_session：复用连接池的 HTTP 客户端，支持 "/pet" 这样的相对路径
+# - server_available / require_server：服务可用性只检查一次
+# - api_resources：共享测试数据，会话结束统一清理
+# - assert_matches_schema(operation, status, body)：按文档校验响应体
+from pytest_api_plugin import *  # noqa: F401,F403
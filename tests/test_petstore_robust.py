@@ -30,40 +30,28 @@ class TestPetStoreAPI:
     }
 
     @pytest.fixture(autouse=True)
-    def setup_method(self):
-        """每个测试方法执行前的设置"""
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        })
-
-    def is_server_available(self):
-        """检查服务器是否可用"""
-        try:
-            response = requests.get(f"{self.BASE_URL}/pet/findByStatus?status=available", timeout=10)
-            return response.status_code != 500
-        except requests.RequestException:
-            return False
+    def setup_method(self, api_session, base_url):
+        """复用会话级 HTTP 客户端（见 conftest.py）"""
+        self.session = api_session
+        self.BASE_URL = base_url
 
     def test_server_connectivity(self):
         """测试服务器连接性"""
         try:
-            response = requests.get(self.BASE_URL.replace('/api/v3', ''), timeout=10)
+            response = self.session.get(self.BASE_URL.replace('/api/v3', ''))
             print(f"服务器连接测试: {response.status_code}")
             # 只要能连接就算成功，不管返回什么状态码
             assert True
         except requests.RequestException as e:
             pytest.fail(f"无法连接到服务器: {e}")
 
-    def test_get_pet_by_id_success(self):
+    def test_get_pet_by_id_success(self, require_server, api_resources):
         """测试根据 ID 查询宠物 - 正常情况"""
-        if not self.is_server_available():
-            pytest.skip("服务器当前不可用，跳过此测试")
-            
-        # 首先尝试创建一个宠物用于查询
+        # 首先尝试创建一个宠物用于查询（同一会话内只创建一次）
         try:
-            create_response = self.session.post(f"{self.BASE_URL}/pet", json=self.VALID_PET_DATA)
+            create_response = api_resources.ensure(
+                "/pet", self.VALID_PET_DATA, cleanup_path=f"/pet/{self.VALID_PET_DATA['id']}"
+            )
             if create_response.status_code not in [200, 201]:
                 pytest.skip("无法创建测试数据，跳过此测试")
         except:
@@ -102,10 +90,13 @@ class TestPetStoreAPI:
         # 断言 - 期望返回错误状态码
         assert response.status_code in [400, 404, 500]
 
-    def test_add_pet_request_format(self):
+    def test_add_pet_request_format(self, api_resources):
         """测试添加新宠物 - 验证请求格式"""
         try:
-            response = self.session.post(f"{self.BASE_URL}/pet", json=self.VALID_PET_DATA)
+            # 与查询用例共用同一次创建，不重复 POST
+            response = api_resources.ensure(
+                "/pet", self.VALID_PET_DATA, cleanup_path=f"/pet/{self.VALID_PET_DATA['id']}"
+            )
             
             # 即使服务器返回500错误，我们也验证了请求格式是正确的
             print(f"添加宠物请求状态码: {response.status_code}")
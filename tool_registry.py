@@ -0,0 +1,261 @@
+"""
+工具注册表
+每个工具通过装饰器注册，声明：
+- 描述和参数说明（input_schema 由函数签名自动生成）
+- 超时时间：超时后立即返回结构化的超时结果，不再阻塞 Agent 主循环；同时通知工具取消，
+  工具内启动的子进程用 time_left() 作为超时、或在 cancel_event() 置位后停止，
+  保证被放弃的调用尽快结束并归还并发名额
+- 最大并发数：同一工具同时执行的调用数上限
+- 是否幂等：幂等工具的结果可以安全复用或重试
+- 结果缓存：幂等工具声明 watch（依赖的文件）后，同一会话内参数相同且文件未变的重复调用
+  直接返回一句引用，不再重复读盘、也不把整段内容再塞进对话；声明 writes 的工具执行时缓存整体失效
+- 调用回调：on_call(**参数) 在每次成功调用后执行（包括命中缓存、工具函数没有运行的情况），
+  用于记录“当前使用的文档”这类不能因缓存而丢失的状态
+
+用法：
+    registry = ToolRegistry()
+
+    @registry.tool("读取文件内容", params={"file_path": "文件路径"}, timeout=10, idempotent=True)
+    def read_file(file_path: str) -> str:
+        ...
+
+    registry.schemas()                        # 传给 messages.create 的 tools
+    registry.execute("read_file", {...})      # 带超时和并发限制的调用
+    registry.execute("read_file", {...}, cache=ToolResultCache())  # 会话内复用结果
+"""
+import contextvars
+import inspect
+import json
+import os
+import threading
+import time
+
+_JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    dict: "object",
+    list: "array",
+}
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONCURRENCY = 4
+
+# 当前工具调用的 (截止时间, 取消事件)，只在工具线程内设置
+_current_call = contextvars.ContextVar("tool_call", default=None)
+
+
+def time_left(default: float) -> float:
+    """当前工具调用剩余的秒数，不超过 default；不在工具调用中时返回 default"""
+    call = _current_call.get()
+    if call is None:
+        return default
+    return max(min(default, call[0] - time.monotonic()), 0)
+
+
+def cancel_event():
+    """当前工具调用的取消事件，调用超时被放弃时置位；不在工具调用中时返回 None"""
+    call = _current_call.get()
+    return call[1] if call is not None else None
+
+
+class Tool:
+    """已注册的工具"""
+
+    def __init__(self, func, description: str, params: dict, timeout: float,
+                 max_concurrency: int, idempotent: bool, watch=None, writes: bool = False,
+                 on_call=None):
+        self.func = func
+        self.name = func.__name__
+        self.description = description
+        self.timeout = timeout
+        self.idempotent = idempotent
+        self.watch = watch
+        self.writes = writes
+        self.on_call = on_call
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.input_schema = build_input_schema(func, params)
+
+    def schema(self) -> dict:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "input_schema": self.input_schema,
+        }
+
+
+def build_input_schema(func, params: dict) -> dict:
+    """根据函数签名生成 JSON Schema。
+    params 的值可以是参数说明字符串，也可以是补充的 schema 片段（如 enum、items）"""
+    properties, required = {}, []
+    for name, param in inspect.signature(func).parameters.items():
+        prop = {}
+        json_type = _JSON_TYPES.get(param.annotation)
+        if json_type:
+            prop["type"] = json_type
+        extra = params.get(name)
+        if isinstance(extra, str):
+            prop["description"] = extra
+        elif isinstance(extra, dict):
+            prop.update(extra)
+        properties[name] = prop
+        if param.default is inspect.Parameter.empty:
+            required.append(name)
+    return {"type": "object", "properties": properties, "required": required}
+
+
+def _error_result(status: str, tool: str, message: str, **extra) -> str:
+    return json.dumps({"status": status, "tool": tool, "message": message, **extra},
+                      ensure_ascii=False)
+
+
+class ToolResultCache:
+    """单个会话内幂等工具的结果缓存。
+    命中条件：工具和参数相同，且 watch 返回的文件 mtime / 大小都没有变化"""
+
+    def __init__(self):
+        self.turn = 0        # 当前轮次，由 Agent 主循环更新
+        self.hits = 0
+        self._entries = {}   # (工具名, 参数) -> (文件指纹, 首次返回的轮次, 结果)
+
+    @staticmethod
+    def _key(name: str, input_data: dict) -> tuple:
+        return name, json.dumps(input_data, sort_keys=True, ensure_ascii=False, default=str)
+
+    @staticmethod
+    def fingerprint(tool: Tool, input_data: dict):
+        """工具依赖文件的 (路径, mtime, 大小)；工具未声明 watch 或参数无法解析时返回 None"""
+        if not tool.idempotent or tool.watch is None:
+            return None
+        try:
+            paths = tool.watch(**input_data)
+        except Exception:
+            return None
+        prints = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                prints.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                prints.append((path, None, None))
+        return tuple(prints)
+
+    def lookup(self, tool: Tool, input_data: dict, fingerprint) -> str:
+        entry = self._entries.get(self._key(tool.name, input_data))
+        if entry is None or entry[0] != fingerprint:
+            return None
+        self.hits += 1
+        _, turn, result = entry
+        reference = f"[结果未变化：与第 {turn} 轮 {tool.name} 的返回完全相同，请直接参考该轮的结果]"
+        # 结果本身比引用还短时直接返回原文
+        return reference if len(reference) < len(result) else result
+
+    def store(self, tool: Tool, input_data: dict, fingerprint, result: str):
+        self._entries[self._key(tool.name, input_data)] = (fingerprint, self.turn, result)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class ToolRegistry:
+    """工具注册与调度"""
+
+    def __init__(self):
+        self._tools = {}
+
+    def tool(self, description: str, params: dict = None, timeout: float = DEFAULT_TIMEOUT,
+             max_concurrency: int = DEFAULT_CONCURRENCY, idempotent: bool = False,
+             watch=None, writes: bool = False, on_call=None):
+        """注册工具的装饰器，函数名即工具名。
+        watch(**参数) 返回幂等工具依赖的文件路径列表，声明后结果可被 ToolResultCache 复用；
+        writes=True 表示工具会写文件，执行时清空会话缓存；
+        on_call(**参数) 在每次成功调用后于调用方线程执行，命中缓存时也会执行"""
+        def decorator(func):
+            self._tools[func.__name__] = Tool(func, description, params or {}, timeout,
+                                              max_concurrency, idempotent, watch, writes,
+                                              on_call)
+            return func
+        return decorator
+
+    def get(self, name: str) -> Tool:
+        return self._tools.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def schemas(self) -> list:
+        return [tool.schema() for tool in self._tools.values()]
+
+    def execute(self, name: str, input_data: dict, cache: ToolResultCache = None,
+                profiler=None) -> str:
+        """调用工具；排队等待和执行的总时长不超过工具的 timeout。
+        传入 cache 时，幂等工具的重复调用在文件未变化时直接返回引用；
+        传入 profiler（见 agent_profiler.AgentProfiler）时在工具线程内剖析本次调用"""
+        tool = self._tools.get(name)
+        if tool is None:
+            return "未知工具"
+
+        try:
+            inspect.signature(tool.func).bind(**input_data)
+        except TypeError as e:
+            return _error_result("invalid_input", name, f"参数错误 - {e}")
+
+        fingerprint = None
+        if cache is not None:
+            if tool.writes:
+                cache.clear()
+            # 指纹在执行前取：执行期间文件被改动时，下次调用不会误命中
+            fingerprint = cache.fingerprint(tool, input_data)
+            if fingerprint is not None:
+                cached = cache.lookup(tool, input_data, fingerprint)
+                if cached is not None:
+                    if tool.on_call is not None:
+                        tool.on_call(**input_data)
+                    return cached
+
+        deadline = time.monotonic() + tool.timeout
+        if not tool.semaphore.acquire(timeout=tool.timeout):
+            return _error_result(
+                "busy", name,
+                f"已有 {tool.max_concurrency} 个调用在执行，等待 {tool.timeout} 秒后仍无空位",
+            )
+
+        outcome = {}
+        done = threading.Event()
+        cancel = threading.Event()
+
+        def run():
+            _current_call.set((deadline, cancel))
+            try:
+                if profiler is not None:
+                    outcome["result"] = profiler.run_tool(name, tool.func, input_data)
+                else:
+                    outcome["result"] = tool.func(**input_data)
+            except Exception as e:
+                outcome["result"] = f"错误：工具执行失败 - {str(e)}"
+            finally:
+                # 超时被放弃的调用也要等真正结束才归还并发名额
+                tool.semaphore.release()
+                done.set()
+
+        # 守护线程：超时后直接放弃，不阻塞主循环也不阻止进程退出。
+        # 在调用方的 contextvars 上下文中执行，工具能拿到当前会话的工作目录等状态
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), name=f"tool-{name}",
+                         daemon=True).start()
+        if not done.wait(max(deadline - time.monotonic(), 0)):
+            cancel.set()
+            return _error_result(
+                "timeout", name,
+                f"工具执行超过 {tool.timeout} 秒，已取消执行，结果将被丢弃",
+                timeout_s=tool.timeout,
+            )
+        result = outcome["result"]
+        succeeded = isinstance(result, str) and not result.startswith("错误")
+        if succeeded and tool.on_call is not None:
+            tool.on_call(**input_data)
+        if succeeded and fingerprint is not None:
+            cache.store(tool, input_data, fingerprint, result)
+        return result